@@ -0,0 +1,379 @@
+"""
+Process-wide admission control for model and warehouse calls
+Every Gemini, embedding, LLM API and BigQuery call is admitted through a
+per-backend gate that provides:
+1. A token-bucket rate limit
+2. A concurrency limit
+3. Priority ordering (interactive work ahead of batch work)
+4. A circuit breaker that rejects calls quickly while a backend is failing
+   (only transport, 5xx and quota errors count; a bad query is not an outage)
+5. Queue wait time metrics
+"""
+
+import heapq
+import itertools
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from google.api_core import exceptions as google_exceptions
+except ImportError:
+    google_exceptions = None
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+# rate: calls per second, burst: token bucket capacity,
+# concurrency: calls in flight, failure_threshold: consecutive failures
+# before the breaker opens, reset_timeout: seconds before a trial call
+BACKEND_LIMITS = {
+    "gemini": {"rate": 5.0, "burst": 10, "concurrency": 8, "failure_threshold": 5, "reset_timeout": 30.0},
+    "embedding": {"rate": 20.0, "burst": 40, "concurrency": 16, "failure_threshold": 5, "reset_timeout": 30.0},
+    "bigquery": {"rate": 10.0, "burst": 20, "concurrency": 8, "failure_threshold": 5, "reset_timeout": 30.0},
+    "llm_api": {"rate": 2.0, "burst": 4, "concurrency": 4, "failure_threshold": 3, "reset_timeout": 30.0},
+}
+DEFAULT_LIMITS = {"rate": 5.0, "burst": 10, "concurrency": 4, "failure_threshold": 5, "reset_timeout": 30.0}
+WAIT_SAMPLE_SIZE = 1000  # recent queue waits kept for percentiles
+
+# HTTP statuses and BigQuery error reasons that mean the backend, not the
+# request, is at fault
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+TRANSIENT_ERROR_REASONS = {"backendError", "internalError", "quotaExceeded", "rateLimitExceeded"}
+
+###############################################################################
+# EXCEPTIONS
+###############################################################################
+
+class AdmissionRejected(Exception):
+    """Raised when a call is not admitted to a backend"""
+
+class CircuitOpenError(AdmissionRejected):
+    """Raised when the backend's circuit breaker is open"""
+
+class AdmissionTimeout(AdmissionRejected):
+    """Raised when a call waits in the queue longer than its timeout"""
+
+class BackendError(Exception):
+    """Raise inside admit() to report a backend failure that has no exception of its own"""
+
+def is_backend_failure(error: BaseException) -> bool:
+    """
+    Whether an error means the backend is unhealthy (connection, timeout,
+    5xx, quota) rather than the request being bad (syntax errors, missing
+    tables, our own bugs). Only the former should trip a circuit breaker.
+    """
+    if isinstance(error, (BackendError, ConnectionError, TimeoutError, subprocess.TimeoutExpired)):
+        return True
+    if google_exceptions is not None:
+        if isinstance(error, (google_exceptions.ServerError, google_exceptions.TooManyRequests,
+                              google_exceptions.RetryError)):
+            return True
+        if isinstance(error, google_exceptions.GoogleAPICallError):
+            # BigQuery reports quota and rate limits as 403 with a reason
+            reasons = {e.get("reason") for e in (error.errors or []) if isinstance(e, dict)}
+            return bool(reasons & TRANSIENT_ERROR_REASONS)
+    if requests is not None:
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError):
+            status = getattr(error.response, "status_code", None)
+            return status in TRANSIENT_STATUS_CODES
+    return False
+
+###############################################################################
+# PRIMITIVES
+###############################################################################
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_take(self) -> float:
+        """Take a token and return 0, or return the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class BreakerTicket:
+    """
+    Handed to each call CircuitBreaker.allow lets through. While the breaker
+    is not closed, only the half-open trial's ticket may report an outcome
+    or give the trial back.
+    """
+
+    __slots__ = ("trial",)
+
+    def __init__(self, trial: bool = False):
+        self.trial = trial
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by consecutive failures"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial: Optional[BreakerTicket] = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[BreakerTicket]:
+        """
+        A ticket if the call may proceed, else None; lets one trial call
+        through when half-open
+        """
+        with self._lock:
+            if self.state == "closed":
+                return BreakerTicket()
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                logger.info(f"Circuit for {self.name} half-open, sending trial call")
+            if self.state == "half_open" and self._trial is None:
+                self._trial = BreakerTicket(trial=True)
+                return self._trial
+            return None
+
+    def release_trial(self, ticket: BreakerTicket):
+        """Give back the half-open trial slot if ticket holds it, e.g. when its call was never admitted"""
+        with self._lock:
+            if ticket is self._trial:
+                self._trial = None
+
+    def record_success(self, ticket: BreakerTicket):
+        """
+        Closes a half-open breaker only for the trial call; calls admitted
+        before the breaker opened cannot close it
+        """
+        with self._lock:
+            if self.state == "closed":
+                self.failures = 0
+            elif ticket is self._trial:
+                logger.info(f"Circuit for {self.name} closed")
+                self.state = "closed"
+                self.failures = 0
+                self._trial = None
+
+    def record_failure(self, ticket: BreakerTicket):
+        with self._lock:
+            if self.state == "closed":
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+            elif ticket is self._trial:
+                # Failed trial: stay open for another reset_timeout
+                self.failures += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial = None
+
+###############################################################################
+# BACKEND GATE
+###############################################################################
+
+class BackendGate:
+    """Rate, concurrency and priority admission for a single backend"""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float,
+        concurrency: int,
+        failure_threshold: int,
+        reset_timeout: float
+    ):
+        self.name = name
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self.metrics = {
+            "admitted": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "failures": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+        self._recent_waits = deque(maxlen=WAIT_SAMPLE_SIZE)
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None) -> BreakerTicket:
+        """
+        Block until the call is admitted; lower priority values go first.
+        Returns the breaker ticket to pass to release.
+        """
+        ticket = self.breaker.allow()
+        if ticket is None:
+            with self._cond:
+                self.metrics["rejected"] += 1
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        entry = (priority, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    retry_in = None
+                    if self._waiters[0] == entry and self._in_flight < self.concurrency:
+                        retry_in = self.bucket.try_take()
+                        if retry_in == 0:
+                            break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.metrics["timeouts"] += 1
+                        raise AdmissionTimeout(f"Timed out waiting for {self.name}")
+                    waits = [w for w in (retry_in, remaining) if w is not None]
+                    self._cond.wait(min(waits) if waits else None)
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                self.breaker.release_trial(ticket)
+                raise
+
+            heapq.heappop(self._waiters)
+            self._in_flight += 1
+            waited = time.monotonic() - start
+            self.metrics["admitted"] += 1
+            self.metrics["wait_total"] += waited
+            self.metrics["wait_max"] = max(self.metrics["wait_max"], waited)
+            self._recent_waits.append(waited)
+            self._cond.notify_all()
+        return ticket
+
+    def release(self, ticket: BreakerTicket, success: Optional[bool] = True):
+        """
+        Free the concurrency slot and report the outcome to the breaker.
+        success=None reports nothing, e.g. when the call raised for a reason
+        that says nothing about the backend's health.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if success is False:
+                self.metrics["failures"] += 1
+            self._cond.notify_all()
+        if success is None:
+            self.breaker.release_trial(ticket)
+        elif success:
+            self.breaker.record_success(ticket)
+        else:
+            self.breaker.record_failure(ticket)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current counters, breaker state and queue wait statistics"""
+        with self._cond:
+            waits = sorted(self._recent_waits)
+            stats = dict(self.metrics)
+            stats["in_flight"] = self._in_flight
+            stats["queued"] = len(self._waiters)
+        stats["state"] = self.breaker.state
+        stats["wait_avg"] = stats["wait_total"] / stats["admitted"] if stats["admitted"] else 0.0
+        stats["wait_p50"] = waits[len(waits) // 2] if waits else 0.0
+        stats["wait_p99"] = waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0
+        return stats
+
+###############################################################################
+# ADMISSION CONTROLLER
+###############################################################################
+
+class AdmissionController:
+    """Registry of backend gates shared by everything in the process"""
+
+    def __init__(self, limits: Dict[str, Dict] = None):
+        self.limits = dict(BACKEND_LIMITS if limits is None else limits)
+        self._gates: Dict[str, BackendGate] = {}
+        self._lock = threading.Lock()
+
+    def gate(self, backend: str) -> BackendGate:
+        """Get or lazily create the gate for a backend"""
+        with self._lock:
+            if backend not in self._gates:
+                self._gates[backend] = BackendGate(backend, **self.limits.get(backend, DEFAULT_LIMITS))
+            return self._gates[backend]
+
+    @contextmanager
+    def admit(
+        self,
+        backend: str,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = None
+    ):
+        """
+        Context manager that holds an admission slot for the enclosed call.
+        The slot is always released; only errors for which is_backend_failure
+        holds count against the circuit breaker.
+        """
+        gate = self.gate(backend)
+        ticket = gate.acquire(priority, timeout)
+        success = True
+        try:
+            yield
+        except BaseException as e:
+            success = False if is_backend_failure(e) else None
+            raise
+        finally:
+            gate.release(ticket, success)
+
+    def call(
+        self,
+        backend: str,
+        fn: Callable,
+        *args,
+        priority: int = PRIORITY_INTERACTIVE,
+        timeout: Optional[float] = None,
+        **kwargs
+    ):
+        """Run fn(*args, **kwargs) once admitted to backend"""
+        with self.admit(backend, priority, timeout):
+            return fn(*args, **kwargs)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Snapshot of every backend's metrics"""
+        with self._lock:
+            gates = list(self._gates.values())
+        return {gate.name: gate.snapshot() for gate in gates}
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_admission_controller() -> AdmissionController:
+    """Return the process-wide admission controller"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
@@ -0,0 +1,73 @@
+"""
+In-process caches
+A small thread-safe LRU cache with per-entry expiry, used for embeddings,
+schema information and query results.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+EMBEDDING_CACHE_SIZE = 10000
+EMBEDDING_CACHE_TTL = 24 * 3600.0
+SCHEMA_CACHE_TTL = 3600.0
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 300.0  # results of monitoring queries go stale quickly
+
+_MISSING = object()
+
+###############################################################################
+# TTL CACHE
+###############################################################################
+
+class TTLCache:
+    """Least-recently-used cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.metrics["hits"] += 1
+                    return value
+                del self._entries[key]
+            self.metrics["misses"] += 1
+            return default
+
+    def set(self, key: Hashable, value: Any):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Cached value for key, computing and storing it on a miss"""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,281 @@
+"""
+Embedding providers
+VectorDatabase gets its vectors from a provider instead of a hard-wired
+Vertex model:
+1. VertexEmbeddingProvider - the remote textembedding-gecko model
+2. SentenceTransformerProvider - a small local model on CPU, optionally
+   through ONNX Runtime
+3. HashingEmbeddingProvider - deterministic feature hashing with no model,
+   for tests and offline use
+Texts are embedded in batches spread over a thread or process pool. Vectors
+from different providers are not comparable (nor, in general, the same
+width), so stored embeddings must be rebuilt (VectorDatabase.reembed_stored)
+after switching.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Sequence
+
+import numpy as np
+
+from lexical import tokenize
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+EMBEDDING_WORKERS = min(4, os.cpu_count() or 1)
+
+VERTEX_MODEL_NAME = "textembedding-gecko@latest"
+VERTEX_BATCH_SIZE = 5        # per-request instance limit of the older gecko versions
+VERTEX_DIMENSION = 768
+
+LOCAL_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_MODEL_BACKEND = "torch"  # or "onnx" (needs sentence-transformers[onnx])
+LOCAL_BATCH_SIZE = 32
+
+HASHING_DIMENSION = 768      # same width as gecko, so table shapes do not change
+HASHING_NGRAM = 3            # character n-grams add some robustness to typos
+HASHING_NGRAM_WEIGHT = 0.5
+
+###############################################################################
+# PROVIDER INTERFACE
+###############################################################################
+
+# Set in each worker of a process pool by _init_worker
+_worker_provider = None
+
+def _init_worker(provider: "EmbeddingProvider"):
+    global _worker_provider
+    _worker_provider = provider
+
+def _embed_in_worker(texts: Sequence[str]) -> np.ndarray:
+    return _worker_provider.embed_batch(texts)
+
+class EmbeddingProvider:
+    """
+    Turns texts into vectors. Subclasses implement embed_batch for at most
+    batch_size texts; embed splits larger inputs and runs the batches on a
+    pool of worker threads (or processes, for pure-Python providers whose
+    work holds the GIL).
+    """
+
+    name = "base"
+    remote = False  # remote providers are admitted through the "embedding" gate
+    dimension = None  # width of the vectors embed returns
+
+    def __init__(self, batch_size: int = 32, workers: int = EMBEDDING_WORKERS, pool: str = "thread"):
+        if pool not in ("thread", "process"):
+            raise ValueError(f"Unsupported pool type: {pool}")
+        self.batch_size = batch_size
+        self.workers = workers
+        self.pool = pool
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """Embed at most batch_size texts into a (len(texts), dim) array"""
+        raise NotImplementedError
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        guard: Callable[[], ContextManager] = nullcontext
+    ) -> np.ndarray:
+        """
+        Embed any number of texts, batch by batch. guard is entered around
+        each batch run on a thread, e.g. to admit remote calls.
+        """
+        texts = list(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+
+        def run(batch):
+            with guard():
+                return self.embed_batch(batch)
+
+        if len(batches) == 1 or self.workers <= 1:
+            results = [run(batch) for batch in batches]
+        elif self.pool == "process":
+            with guard():
+                results = list(self._get_executor().map(_embed_in_worker, batches))
+        else:
+            results = list(self._get_executor().map(run, batches))
+        return np.vstack(results).astype(np.float32, copy=False)
+
+    def embed_one(self, text: str, guard: Callable[[], ContextManager] = nullcontext) -> List[float]:
+        return self.embed([text], guard)[0].tolist()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                if self.pool == "process":
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        initializer=_init_worker,
+                        initargs=(self,)
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix=f"embed-{self.name}"
+                    )
+            return self._executor
+
+    def close(self):
+        """Shut down the worker pool, if one was started"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+    def __getstate__(self) -> Dict:
+        # Sent to process-pool workers, which start their own pool and model
+        state = self.__dict__.copy()
+        state["_executor"] = None
+        state["_executor_lock"] = None
+        state.pop("_model", None)
+        return state
+
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self._executor_lock = threading.Lock()
+        if hasattr(type(self), "_model"):
+            self._model = None
+
+###############################################################################
+# PROVIDERS
+###############################################################################
+
+class VertexEmbeddingProvider(EmbeddingProvider):
+    """Vertex AI text embedding model"""
+
+    name = "vertex"
+    remote = True
+    _model = None
+
+    def __init__(
+        self,
+        model_name: str = VERTEX_MODEL_NAME,
+        batch_size: int = VERTEX_BATCH_SIZE,
+        workers: int = EMBEDDING_WORKERS
+    ):
+        super().__init__(batch_size, workers, "thread")
+        self.model_name = model_name
+        self.dimension = VERTEX_DIMENSION
+        self._model = None
+
+    def _get_model(self):
+        with self._executor_lock:
+            if self._model is None:
+                from vertexai.preview.language_models import TextEmbeddingModel
+                self._model = TextEmbeddingModel.from_pretrained(self.model_name)
+            return self._model
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        result = self._get_model().get_embeddings(list(texts))
+        return np.array([embedding.values for embedding in result], dtype=np.float32)
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    """Small sentence-transformers model run in-process on CPU"""
+
+    name = "sentence-transformers"
+    _model = None
+
+    def __init__(
+        self,
+        model_name: str = LOCAL_MODEL_NAME,
+        backend: str = LOCAL_MODEL_BACKEND,
+        batch_size: int = LOCAL_BATCH_SIZE,
+        workers: int = EMBEDDING_WORKERS,
+        pool: str = "thread"
+    ):
+        super().__init__(batch_size, workers, pool)
+        self.model_name = model_name
+        self.backend = backend
+        self._model = None
+
+    def _get_model(self):
+        with self._executor_lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError as e:
+                    raise ImportError(
+                        "sentence-transformers is required for the local embedding provider"
+                    ) from e
+                options = {} if self.backend == "torch" else {"backend": self.backend}
+                self._model = SentenceTransformer(self.model_name, device="cpu", **options)
+            return self._model
+
+    @property
+    def dimension(self) -> int:
+        # Depends on the model (384 for MiniLM), so it is read from the model itself
+        return self._get_model().get_sentence_embedding_dimension()
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        return self._get_model().encode(
+            list(texts),
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Signed feature hashing of word tokens and character n-grams. No model
+    and fully deterministic across processes; captures lexical overlap only.
+    Runs on threads by default; pool="process" spreads large re-embedding
+    jobs over cores, but needs a picklable provider and, under spawn, an
+    importable main module.
+    """
+
+    name = "hashing"
+
+    def __init__(
+        self,
+        dimension: int = HASHING_DIMENSION,
+        batch_size: int = LOCAL_BATCH_SIZE,
+        workers: int = EMBEDDING_WORKERS,
+        pool: str = "thread"
+    ):
+        super().__init__(batch_size, workers, pool)
+        self.dimension = dimension
+
+    def _features(self, text: str) -> Dict[str, float]:
+        features: Dict[str, float] = {}
+        for token in tokenize(text):
+            features[token] = features.get(token, 0.0) + 1.0
+            padded = f"<{token}>"
+            for i in range(len(padded) - HASHING_NGRAM + 1):
+                gram = "#" + padded[i:i + HASHING_NGRAM]
+                features[gram] = features.get(gram, 0.0) + HASHING_NGRAM_WEIGHT
+        return features
+
+    def embed_batch(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text).items():
+                # Python's hash() is salted per process, so use a stable digest
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                sign = 1.0 if digest & 1 else -1.0
+                vectors[row, (digest >> 1) % self.dimension] += sign * weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+PROVIDERS = {
+    VertexEmbeddingProvider.name: VertexEmbeddingProvider,
+    SentenceTransformerProvider.name: SentenceTransformerProvider,
+    HashingEmbeddingProvider.name: HashingEmbeddingProvider,
+}
+
+def get_embedding_provider(name: str, **options) -> EmbeddingProvider:
+    """Construct a provider by name, e.g. get_embedding_provider("hashing")"""
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown embedding provider: {name}")
+    return PROVIDERS[name](**options)
@@ -0,0 +1,163 @@
+"""
+NL to SQL - Verizon
+Gradio front end for the function-calling DatabaseAnalyzer in testsql:
+1. Project, dataset and question inputs
+2. Intermediate function calls streamed into an expandable panel as they happen
+3. A queued, concurrency-limited request path (see loadtest.py for sizing it)
+4. Each new analyzer warms its caches from the query journal in the background
+"""
+
+import threading
+from typing import Callable, Dict, Sequence, Tuple
+
+import gradio as gr
+
+from testsql import BIGQUERY_DATASET_ID, BIGQUERY_PROJECT_ID, DatabaseAnalyzer
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+APP_TITLE = "NL to SQL - Verizon"
+APP_CONCURRENCY_LIMIT = 4   # requests processed at once by one worker
+APP_MAX_QUEUE_SIZE = 64     # requests beyond this many waiting are rejected
+STEP_RESPONSE_CHARS = 2000  # function responses are truncated in the steps panel
+WARM_CACHES_ON_STARTUP = True  # replay frequent journaled questions per analyzer
+
+PROCESSING_MESSAGE = "⏳ Processing..."
+
+###############################################################################
+# APP
+###############################################################################
+
+def format_step(number: int, step: Dict) -> str:
+    """Render one function call for the intermediate steps panel"""
+    response = str(step["response"])
+    if len(response) > STEP_RESPONSE_CHARS:
+        response = response[:STEP_RESPONSE_CHARS] + " ..."
+    return (
+        f"**{number}. `{step['function']}`**\n\n"
+        f"Parameters: `{step['params']}`\n\n"
+        f"```\n{response}\n```"
+    )
+
+def build_app(
+    analyzer_factory: Callable[..., DatabaseAnalyzer] = DatabaseAnalyzer,
+    concurrency_limit: int = APP_CONCURRENCY_LIMIT,
+    max_queue_size: int = APP_MAX_QUEUE_SIZE,
+    preload: Sequence[Tuple[str, str]] = (),
+    warm_caches: bool = WARM_CACHES_ON_STARTUP
+) -> gr.Blocks:
+    """
+    Build the Gradio app; analyzer_factory lets tests swap in stand-in
+    backends. Analyzers for the (project, dataset) pairs in preload are
+    built in the background at startup instead of in the first request.
+    """
+    analyzers: Dict[Tuple[str, str], DatabaseAnalyzer] = {}
+    init_locks: Dict[Tuple[str, str], threading.Lock] = {}
+    analyzers_lock = threading.Lock()
+
+    def get_analyzer(project_id: str, dataset_id: str) -> DatabaseAnalyzer:
+        """
+        One analyzer (and BigQuery client) per project and dataset. Analyzers
+        are built under a per-key lock, so a slow project only delays
+        requests for that project.
+        """
+        key = (project_id, dataset_id)
+        with analyzers_lock:
+            if key in analyzers:
+                return analyzers[key]
+            init_lock = init_locks.setdefault(key, threading.Lock())
+        with init_lock:
+            with analyzers_lock:
+                if key in analyzers:
+                    return analyzers[key]
+            analyzer = analyzer_factory(project_id=project_id, dataset_id=dataset_id)
+            with analyzers_lock:
+                analyzers[key] = analyzer
+            if warm_caches:
+                # Batch-priority replay, off the request path
+                threading.Thread(
+                    target=analyzer.warm_caches,
+                    name=f"warm-{project_id}.{dataset_id}",
+                    daemon=True
+                ).start()
+            return analyzer
+
+    def preload_analyzer(project_id: str, dataset_id: str):
+        try:
+            get_analyzer(project_id, dataset_id)
+        except Exception as e:
+            print(f"Failed to preload analyzer for {project_id}.{dataset_id}: {str(e)}")
+
+    def answer(project_id: str, dataset_id: str, question: str):
+        """Stream (result, steps) updates while the query is processed"""
+        if not question or not question.strip():
+            yield "Please enter a question.", ""
+            return
+
+        yield PROCESSING_MESSAGE, ""
+        try:
+            analyzer = get_analyzer(project_id, dataset_id)
+        except Exception as e:
+            yield f"❌ Failed to initialize database analyzer: {str(e)}", ""
+            return
+
+        steps = []
+        for step in analyzer.process_query_steps(question):
+            if "answer" in step:
+                yield step["answer"], "\n\n".join(steps)
+            else:
+                steps.append(format_step(len(steps) + 1, step))
+                yield PROCESSING_MESSAGE, "\n\n".join(steps)
+
+    with gr.Blocks(title=APP_TITLE) as demo:
+        gr.Markdown(f"# {APP_TITLE}")
+        with gr.Row():
+            project = gr.Dropdown(
+                label="Project",
+                choices=[BIGQUERY_PROJECT_ID],
+                value=BIGQUERY_PROJECT_ID,
+                allow_custom_value=True
+            )
+            dataset = gr.Dropdown(
+                label="Dataset",
+                choices=[BIGQUERY_DATASET_ID],
+                value=BIGQUERY_DATASET_ID,
+                allow_custom_value=True
+            )
+        question = gr.Textbox(
+            label="Question",
+            lines=2,
+            placeholder="e.g. What percentage of API calls failed in the last day?"
+        )
+        submit = gr.Button("Run", variant="primary")
+        result = gr.Markdown(label="Result")
+        with gr.Accordion("Intermediate steps (function calls)", open=False):
+            steps = gr.Markdown()
+
+        # Both triggers share one concurrency group and so one limit
+        event_options = dict(
+            fn=answer,
+            inputs=[project, dataset, question],
+            outputs=[result, steps],
+            concurrency_limit=concurrency_limit,
+            concurrency_id="answer"
+        )
+        submit.click(api_name="answer", **event_options)
+        question.submit(**event_options)
+
+    demo.queue(max_size=max_queue_size)
+    for project_id, dataset_id in preload:
+        threading.Thread(
+            target=preload_analyzer,
+            args=(project_id, dataset_id),
+            daemon=True
+        ).start()
+    return demo
+
+def main():
+    build_app(preload=[(BIGQUERY_PROJECT_ID, BIGQUERY_DATASET_ID)]).launch()
+
+if __name__ == "__main__":
+    main()
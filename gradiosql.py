@@ -9,8 +9,12 @@ Key improvements:
 5. Dynamic prompt refinement
 """
 
+import threading
 import time
-from typing import List, Dict, Any, Union
+import numpy as np
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Any, Optional, Union
 from google.cloud import bigquery
 from google.api_core import exceptions
 from vertexai.generative_models import (
@@ -20,7 +24,32 @@ from vertexai.generative_models import (
     Tool,
     ChatModel
 )
-from vertexai.preview.language_models import TextEmbeddingModel
+
+from admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_admission_controller
+from caches import (
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_TTL,
+    RESULT_CACHE_SIZE,
+    RESULT_CACHE_TTL,
+    SCHEMA_CACHE_TTL,
+    TTLCache
+)
+from embeddings import VERTEX_DIMENSION, EmbeddingProvider, VertexEmbeddingProvider, get_embedding_provider
+from journal import WARMUP_LIMIT, get_query_journal
+from lexical import LexicalIndex, fuse_scores
+from quantization import (
+    LocalVectorIndex,
+    dequantize,
+    int8_from_bytes,
+    int8_to_bytes,
+    measure_recall,
+    normalize,
+    quantize
+)
+from resultset import ResultSet
+from rollups import RollupManager
+from singleflight import get_single_flight, prompt_key, sql_key
+from sqlexport import EXPORT_PAGE_SIZE, bigquery_arrow_schema, export_results, iter_bigquery_pages
 
 ###############################################################################
 # CONFIGURATIONS 
@@ -29,6 +58,63 @@ from vertexai.preview.language_models import TextEmbeddingModel
 BIGQUERY_PROJECT_ID = "your-project-id"
 BIGQUERY_DATASET_ID = "your-dataset-id"
 
+# Multi-candidate SQL generation. With more than one candidate the pipeline
+# asks Gemini for several SQL statements concurrently, dry-runs each as it
+# arrives and executes the cheapest valid one.
+SQL_CANDIDATE_COUNT = 1
+SQL_CANDIDATE_TEMPERATURES = [0.0, 0.3, 0.6, 0.9]
+SQL_CANDIDATE_HINTS = [
+    "",
+    "\nPrefer the simplest query that answers the question.",
+    "\nSelect only the columns you need and filter as early as possible.",
+    "\nUse fully qualified table names and explicit column aliases.",
+]
+SQL_CANDIDATE_GRACE_SECONDS = 2.0  # wait this long for cheaper candidates after the first valid one
+SQL_CANDIDATE_ADMISSION_TIMEOUT = 10.0  # a candidate gives up rather than queue longer for a slot
+
+# Route eligible count/percentage queries to pre-aggregated rollup tables.
+# Build them once with RollupManager.create_tables() and refresh periodically.
+USE_ROLLUPS = False
+
+# Embeddings are stored pre-normalized as int8 codes plus a per-vector scale
+# (BYTES + FLOAT64) and scored with a plain dot product. Keeping the
+# full-precision ARRAY<FLOAT64> as well is only needed for recall checks.
+QUANTIZED_EMBEDDINGS = True
+STORE_FULL_PRECISION_EMBEDDINGS = False
+LOCAL_INDEX_DTYPE = "int8"  # or "float16"
+RECALL_HOLDOUT_FRACTION = 0.1  # share of the recall sample used as queries, not corpus
+
+# Similarity of a stored row to the normalized @query_embedding: a dot
+# product over the int8 codes. Rows written before quantization are
+# backfilled when the columns are added (VectorDatabase._init_vector_store),
+# so queries never touch the full-precision column, which BigQuery would
+# bill in full even inside an untaken IF branch.
+# Codes are stored as unsigned bytes (code + 128), see quantization.int8_to_bytes
+QUANTIZED_SCORE_SQL = """scale * (
+                    SELECT SUM((code - 128) * @query_embedding[OFFSET(pos)])
+                    FROM UNNEST(TO_CODE_POINTS(embedding_q)) code WITH OFFSET pos
+                )"""
+
+# Hybrid retrieval: a local BM25 index over the stored texts preselects
+# candidates so only those vectors are scored, and answers queries that name
+# known identifiers (columns, tables, APIs) without an embedding call.
+HYBRID_RETRIEVAL = True
+LEXICAL_CANDIDATES = 50
+HYBRID_VECTOR_WEIGHT = 0.7
+
+# Every answered question is journaled (question, SQL, tables, stage timings,
+# bytes processed). At startup the most frequent recent entries are replayed
+# to warm the embedding, schema and result caches.
+JOURNAL_ENABLED = True
+WARM_CACHES_ON_STARTUP = True
+
+# Where embeddings come from: "vertex" (remote), "sentence-transformers" (local
+# CPU model) or "hashing" (no model). Vectors from different providers do not
+# mix; run VectorDatabase.reembed_stored() after changing this. The provider
+# name and vector width are kept as labels on the embeddings table, and a
+# VectorDatabase whose provider does not match them refuses to start.
+EMBEDDING_PROVIDER = "vertex"
+
 # Function declarations for BigQuery operations
 list_datasets_func = FunctionDeclaration(
     name="list_datasets",
@@ -82,9 +168,24 @@ execute_query_func = FunctionDeclaration(
 class VectorDatabase:
     """Manages embeddings and metadata in BigQuery"""
     
-    def __init__(self):
+    def __init__(self, embedding_provider: EmbeddingProvider = None, check_embeddings: bool = True):
+        """
+        check_embeddings=False skips the provider check, to open a table
+        built by another provider and rebuild it with reembed_stored()
+        """
+        self.check_embeddings = check_embeddings
         self.client = bigquery.Client(project=BIGQUERY_PROJECT_ID)
-        self.embedding_model = TextEmbeddingModel.from_pretrained("textembedding-gecko@latest")
+        self.embedding_provider = embedding_provider or get_embedding_provider(EMBEDDING_PROVIDER)
+        self.admission = get_admission_controller()
+        self.embedding_flight = get_single_flight("embedding")
+        self.embedding_cache = TTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+        self.local_index = None
+        self.lexical_index = None
+        self.lexical_items: List[Dict] = []
+        # Guards lexical_index, lexical_items and retrieval_stats; documents
+        # are added while other users search
+        self._lexical_lock = threading.Lock()
+        self.retrieval_stats = {"lexical_only": 0, "hybrid": 0, "vector": 0, "vectors_scored": 0}
         self._init_vector_store()
         
     def _init_vector_store(self):
@@ -95,45 +196,153 @@ class VectorDatabase:
             bigquery.SchemaField("text", "STRING"),
             bigquery.SchemaField("embedding", "ARRAY", mode="REPEATED", 
                                field_type="FLOAT64"),
-            bigquery.SchemaField("metadata", "STRING")
+            bigquery.SchemaField("metadata", "STRING"),
+            bigquery.SchemaField("embedding_q", "BYTES"),
+            bigquery.SchemaField("scale", "FLOAT64")
         ]
         
         table_id = f"{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings"
         try:
-            self.client.get_table(table_id)
+            table = self.client.get_table(table_id)
+            # Add quantized columns to tables created before they existed
+            existing = {field.name for field in table.schema}
+            missing = [field for field in embedding_schema if field.name not in existing]
+            if missing:
+                table.schema = list(table.schema) + missing
+                self.client.update_table(table, ["schema"])
+                if QUANTIZED_EMBEDDINGS:
+                    self.backfill_quantized()
+            if self.check_embeddings:
+                self._check_embedding_provider(table)
         except exceptions.NotFound:
             table = bigquery.Table(table_id, schema=embedding_schema)
+            table.labels = self._embedding_labels()
             self.client.create_table(table)
+    
+    def _embedding_labels(self) -> Dict[str, str]:
+        return {
+            "embedding_provider": self.embedding_provider.name,
+            "embedding_dimension": str(self.embedding_provider.dimension),
+        }
+    
+    def _check_embedding_provider(self, table):
+        """
+        Fail fast when the stored vectors came from another provider; they
+        differ in width (384 for MiniLM, 768 for gecko and hashing) or, at
+        the same width, are still not comparable
+        """
+        expected = self._embedding_labels()
+        labels = table.labels or {}
+        if "embedding_provider" in labels:
+            stored = {key: labels.get(key) for key in expected}
+        elif self._stored_dimension() is None:
+            # Nothing stored yet, so any provider may claim the table
+            stored = expected
+        else:
+            # Tables from before the labels were only ever written by Vertex.
+            # Width alone cannot tell gecko from hashing, which are both 768.
+            stored = {
+                "embedding_provider": VertexEmbeddingProvider.name,
+                "embedding_dimension": str(VERTEX_DIMENSION),
+            }
+        if stored != expected:
+            raise RuntimeError(
+                f"The embeddings table holds {stored['embedding_dimension']}-dimensional vectors "
+                f"from the {stored['embedding_provider']!r} provider, but the {expected['embedding_provider']!r} provider produces "
+                f"{expected['embedding_dimension']}-dimensional ones. Switch EMBEDDING_PROVIDER back, "
+                f"or rebuild the stored vectors with VectorDatabase(check_embeddings=False).reembed_stored()."
+            )
+        if labels.get("embedding_provider") is None:
+            table.labels = {**labels, **stored}
+            self.client.update_table(table, ["labels"])
+    
+    def _stored_dimension(self) -> Optional[int]:
+        """Width of a stored vector, or None if the table is empty"""
+        query = f"""
+        SELECT IF(embedding_q IS NOT NULL, BYTE_LENGTH(embedding_q), ARRAY_LENGTH(embedding)) AS dimension
+        FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
+        WHERE embedding_q IS NOT NULL OR ARRAY_LENGTH(embedding) > 0
+        LIMIT 1
+        """
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            rows = list(self.client.query(query).result())
+        return rows[0]["dimension"] if rows else None
             
-    def generate_embedding(self, text: str) -> List[float]:
-        """Generate embedding using Vertex AI"""
-        result = self.embedding_model.get_embeddings([text])
-        return result[1].values
+    def _embedding_guard(self, priority: int):
+        """Admission for remote providers; local ones need no gate"""
+        if self.embedding_provider.remote:
+            return lambda: self.admission.admit("embedding", priority=priority)
+        return nullcontext
+        
+    def generate_embedding(self, text: str, priority: int = PRIORITY_INTERACTIVE) -> List[float]:
+        """Generate embedding using the configured provider"""
+        def embed():
+            return self.embedding_provider.embed_one(text, self._embedding_guard(priority))
+        
+        key = prompt_key("embedding", self.embedding_provider.name, text)
+        return self.embedding_cache.get_or_compute(
+            text,
+            lambda: self.embedding_flight.do(key, embed)
+        )
+        
+    def generate_embeddings(self, texts: List[str], priority: int = PRIORITY_BATCH) -> List[List[float]]:
+        """Embed many texts at once; cache misses go to the provider in batches"""
+        embeddings = {text: self.embedding_cache.get(text) for text in texts}
+        missing = list(dict.fromkeys(text for text, value in embeddings.items() if value is None))
+        if missing:
+            vectors = self.embedding_provider.embed(missing, self._embedding_guard(priority))
+            for text, vector in zip(missing, vectors):
+                embeddings[text] = vector.tolist()
+                self.embedding_cache.set(text, embeddings[text])
+        return [embeddings[text] for text in texts]
         
     def store_embedding(self, text: str, metadata: Dict = None):
         """Store text embedding in BigQuery"""
-        embedding = self.generate_embedding(text)
+        embedding = self.generate_embedding(text, priority=PRIORITY_BATCH)
+        codes, scales = quantize(embedding, "int8")
+        row_id = str(time.time())
         
         query = f"""
         INSERT INTO `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
-        (id, text, embedding, metadata)
-        VALUES(@id, @text, @embedding, @metadata)
+        (id, text, embedding, metadata, embedding_q, scale)
+        VALUES(@id, @text, @embedding, @metadata, @embedding_q, @scale)
         """
         
+        full_precision = embedding if STORE_FULL_PRECISION_EMBEDDINGS or not QUANTIZED_EMBEDDINGS else []
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("id", "STRING", str(time.time())),
+                bigquery.ScalarQueryParameter("id", "STRING", row_id),
                 bigquery.ScalarQueryParameter("text", "STRING", text),
-                bigquery.ArrayQueryParameter("embedding", "FLOAT64", embedding),
-                bigquery.ScalarQueryParameter("metadata", "STRING", str(metadata))
+                bigquery.ArrayQueryParameter("embedding", "FLOAT64", full_precision),
+                bigquery.ScalarQueryParameter("metadata", "STRING", str(metadata)),
+                bigquery.ScalarQueryParameter("embedding_q", "BYTES", int8_to_bytes(codes[0])),
+                bigquery.ScalarQueryParameter("scale", "FLOAT64", float(scales[0]))
             ]
         )
         
-        self.client.query(query, job_config=job_config).result()
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            self.client.query(query, job_config=job_config).result()
+        
+        # Keep in-memory copies in step with the table
+        item = {"id": row_id, "text": text, "metadata": str(metadata)}
+        if self.local_index is not None:
+            self.local_index.add([embedding], [item])
+        with self._lexical_lock:
+            if self.lexical_index is not None:
+                # Item first, so a doc_id returned by a search always resolves
+                self.lexical_items.append(item)
+                self.lexical_index.add([text])
         
     def similarity_search(self, query_text: str, k: int = 5) -> List[Dict]:
         """Find similar texts using cosine similarity in BigQuery"""
         query_embedding = self.generate_embedding(query_text)
+        if self.local_index is not None:
+            return [
+                item for item in self.local_index.search(query_embedding, k)
+                if item["similarity_score"] > 0
+            ]
+        if QUANTIZED_EMBEDDINGS:
+            return self._quantized_similarity_search(query_embedding, k)
         
         similarity_query = f"""
         WITH similarity AS (
@@ -163,9 +372,282 @@ class VectorDatabase:
             ]
         )
         
-        results = self.client.query(similarity_query, job_config=job_config).result()
+        with self.admission.admit("bigquery"):
+            results = self.client.query(similarity_query, job_config=job_config).result()
+        return [dict(row) for row in results]
+
+    def _quantized_similarity_search(self, query_embedding: List[float], k: int) -> List[Dict]:
+        """
+        Score stored int8 codes against the normalized query with a dot
+        product
+        """
+        similarity_query = f"""
+        WITH similarity AS (
+            SELECT 
+                text,
+                metadata,
+                {QUANTIZED_SCORE_SQL} as similarity_score
+            FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
+            WHERE embedding_q IS NOT NULL
+        )
+        SELECT *
+        FROM similarity
+        WHERE similarity_score > 0
+        ORDER BY similarity_score DESC
+        LIMIT @k
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("query_embedding", "FLOAT64",
+                                           normalize(query_embedding).tolist()),
+                bigquery.ScalarQueryParameter("k", "INT64", k)
+            ]
+        )
+        
+        with self.admission.admit("bigquery"):
+            results = self.client.query(similarity_query, job_config=job_config).result()
         return [dict(row) for row in results]
 
+    def load_local_index(self, dtype: str = LOCAL_INDEX_DTYPE) -> LocalVectorIndex:
+        """Copy the quantized vectors into memory and search them locally from now on"""
+        query = f"""
+        SELECT id, text, metadata, embedding_q, scale
+        FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
+        WHERE embedding_q IS NOT NULL
+        """
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            rows = list(self.client.query(query).result())
+        
+        index = LocalVectorIndex(dtype)
+        items = [{"id": row["id"], "text": row["text"], "metadata": row["metadata"]} for row in rows]
+        if rows:
+            codes = np.stack([int8_from_bytes(row["embedding_q"]) for row in rows])
+            scales = np.array([row["scale"] for row in rows], dtype=np.float32)
+            if dtype == "int8":
+                index.add_quantized(codes, scales, items)
+            else:
+                index.add(dequantize(codes, scales), items)
+        self.local_index = index
+        self._build_lexical_index(items)
+        return index
+
+    def load_lexical_index(self) -> LexicalIndex:
+        """Build the BM25 index from the stored texts without copying vectors"""
+        if self.local_index is not None:
+            # Keep document ids aligned with the local vector rows
+            return self._build_lexical_index(self.local_index.items)
+        query = f"""
+        SELECT id, text, metadata
+        FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
+        """
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            rows = list(self.client.query(query).result())
+        return self._build_lexical_index([dict(row) for row in rows])
+
+    def _build_lexical_index(self, items: List[Dict]) -> LexicalIndex:
+        """Index item texts; document ids are positions in items"""
+        index = LexicalIndex()
+        index.add([item["text"] for item in items])
+        with self._lexical_lock:
+            self.lexical_index = index
+            self.lexical_items = list(items)
+        return index
+
+    def hybrid_search(self, query_text: str, k: int = 5) -> List[Dict]:
+        """
+        Lexical prefilter fused with vector scores over the candidates only.
+
+        Queries whose identifiers are all found in the best lexical match are
+        answered from the lexical index alone. Queries with no lexical
+        candidates fall back to a full similarity_search.
+        """
+        if self.lexical_index is None:
+            # Normally built at startup by RAGPipeline.warm_caches
+            if self.local_index is not None:
+                self._build_lexical_index(self.local_index.items)
+            else:
+                self.load_lexical_index()
+        
+        with self._lexical_lock:
+            # items is only appended to, or replaced whole on a rebuild, so
+            # every doc_id found here stays valid in it after the lock
+            items = self.lexical_items
+            lexical = self.lexical_index.search(query_text, LEXICAL_CANDIDATES)
+            if not lexical:
+                route = "vector"
+            elif self.lexical_index.strong_match(query_text, lexical[0][0]):
+                route = "lexical_only"
+            else:
+                route = "hybrid"
+                self.retrieval_stats["vectors_scored"] += len(lexical)
+            self.retrieval_stats[route] += 1
+        
+        if route == "vector":
+            return self.similarity_search(query_text, k)
+        if route == "lexical_only":
+            return [
+                dict(items[doc_id], similarity_score=score)
+                for doc_id, score in lexical[:k]
+            ]
+        
+        query_embedding = self.generate_embedding(query_text)
+        doc_ids = [doc_id for doc_id, _ in lexical]
+        if self.local_index is not None:
+            vector_scores = self.local_index.scores(query_embedding, doc_ids)
+            vector = dict(zip(doc_ids, (float(score) for score in vector_scores)))
+        else:
+            vector = self._score_candidates(query_embedding, doc_ids, items)
+        
+        fused = fuse_scores(dict(lexical), vector, HYBRID_VECTOR_WEIGHT)
+        return [
+            dict(items[doc_id], similarity_score=score)
+            for doc_id, score in fused[:k]
+        ]
+
+    def _score_candidates(
+        self,
+        query_embedding: List[float],
+        doc_ids: List[int],
+        items: List[Dict]
+    ) -> Dict[int, float]:
+        """Vector scores for lexical candidates (positions in items) only, computed in BigQuery"""
+        positions = {items[doc_id]["id"]: doc_id for doc_id in doc_ids}
+        similarity_query = f"""
+        SELECT 
+            id,
+            {QUANTIZED_SCORE_SQL} as similarity_score
+        FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
+        WHERE id IN UNNEST(@ids) AND embedding_q IS NOT NULL
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("query_embedding", "FLOAT64",
+                                           normalize(query_embedding).tolist()),
+                bigquery.ArrayQueryParameter("ids", "STRING", list(positions))
+            ]
+        )
+        
+        with self.admission.admit("bigquery"):
+            results = self.client.query(similarity_query, job_config=job_config).result()
+        return {positions[row["id"]]: row["similarity_score"] for row in results}
+
+    def backfill_quantized(self):
+        """
+        Quantize rows that only have a full-precision embedding, in BigQuery,
+        and drop their float arrays unless STORE_FULL_PRECISION_EMBEDDINGS
+        """
+        table = f"`{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`"
+        clear_full = "" if STORE_FULL_PRECISION_EMBEDDINGS else ", embedding = []"
+        query = f"""
+        UPDATE {table} t
+        SET embedding_q = src.embedding_q, scale = src.scale{clear_full}
+        FROM (
+            SELECT
+                id,
+                CODE_POINTS_TO_BYTES(ARRAY(
+                    SELECT CAST(ROUND(x / norm / scale) + 128 AS INT64)
+                    FROM UNNEST(embedding) x WITH OFFSET pos
+                    ORDER BY pos
+                )) AS embedding_q,
+                scale
+            FROM (
+                SELECT
+                    id,
+                    embedding,
+                    norm,
+                    (SELECT MAX(ABS(x)) FROM UNNEST(embedding) x) / norm / 127 AS scale
+                FROM (
+                    SELECT id, embedding, SQRT((SELECT SUM(x * x) FROM UNNEST(embedding) x)) AS norm
+                    FROM {table}
+                    WHERE embedding_q IS NULL AND ARRAY_LENGTH(embedding) > 0
+                )
+                WHERE norm > 0
+            )
+        ) src
+        WHERE t.id = src.id
+        """
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            self.client.query(query).result()
+
+    def reembed_stored(self, batch_size: int = 500) -> int:
+        """
+        Recompute every stored embedding with the current provider, e.g. after
+        changing EMBEDDING_PROVIDER. Returns the number of rows rewritten.
+        """
+        table = f"`{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`"
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            rows = list(self.client.query(f"SELECT id, text FROM {table}").result())
+        
+        update_query = f"""
+        UPDATE {table} t
+        SET embedding_q = src.embedding_q, scale = src.scale, embedding = src.embedding
+        FROM UNNEST(@rows) src
+        WHERE t.id = src.id
+        """
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            vectors = self.embedding_provider.embed(
+                [row["text"] for row in batch], self._embedding_guard(PRIORITY_BATCH)
+            )
+            codes, scales = quantize(vectors, "int8")
+            keep_full = STORE_FULL_PRECISION_EMBEDDINGS or not QUANTIZED_EMBEDDINGS
+            params = [
+                bigquery.StructQueryParameter(
+                    None,
+                    bigquery.ScalarQueryParameter("id", "STRING", row["id"]),
+                    bigquery.ScalarQueryParameter("embedding_q", "BYTES", int8_to_bytes(code)),
+                    bigquery.ScalarQueryParameter("scale", "FLOAT64", float(scale)),
+                    bigquery.ArrayQueryParameter(
+                        "embedding", "FLOAT64", vector.tolist() if keep_full else []
+                    )
+                )
+                for row, code, scale, vector in zip(batch, codes, scales, vectors)
+            ]
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ArrayQueryParameter("rows", "STRUCT", params)]
+            )
+            with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+                self.client.query(update_query, job_config=job_config).result()
+        
+        # Record the new provider so the next start passes the check
+        table = self.client.get_table(f"{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings")
+        table.labels = {**(table.labels or {}), **self._embedding_labels()}
+        self.client.update_table(table, ["labels"])
+        
+        # Cached and in-memory vectors came from the previous provider
+        self.embedding_cache.clear()
+        if self.local_index is not None:
+            self.load_local_index(self.local_index.dtype)
+        return len(rows)
+
+    def measure_recall(self, sample_size: int = 500, k: int = 5, dtype: str = LOCAL_INDEX_DTYPE) -> Dict:
+        """
+        Recall@k of quantized search versus full precision over a sample of
+        rows that still have a full-precision embedding. A holdout of the
+        sample serves as queries so no query is scored against itself.
+        """
+        query = f"""
+        SELECT embedding
+        FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.embeddings`
+        WHERE ARRAY_LENGTH(embedding) > 0
+        LIMIT @sample_size
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("sample_size", "INT64", sample_size)
+            ]
+        )
+        with self.admission.admit("bigquery", priority=PRIORITY_BATCH):
+            rows = list(self.client.query(query, job_config=job_config).result())
+        holdout = max(1, int(len(rows) * RECALL_HOLDOUT_FRACTION))
+        if len(rows) <= holdout:
+            return {"dtype": dtype, "k": k, "queries": 0, "recall": None}
+        
+        vectors = np.array([row["embedding"] for row in rows], dtype=np.float32)
+        return measure_recall(vectors[holdout:], vectors[:holdout], k=k, dtype=dtype)
+
 ###############################################################################
 # RAG PIPELINE
 ###############################################################################
@@ -173,9 +655,28 @@ class VectorDatabase:
 class RAGPipeline:
     """Enhanced RAG Pipeline with BigQuery integration"""
     
-    def __init__(self):
+    def __init__(self, num_sql_candidates: int = SQL_CANDIDATE_COUNT):
         self.vector_db = VectorDatabase()
         self.client = bigquery.Client(project=BIGQUERY_PROJECT_ID)
+        self.admission = get_admission_controller()
+        # Concurrent identical queries and prompts share one job / model call
+        self.query_flight = get_single_flight("bigquery")
+        self.model_flight = get_single_flight("gemini")
+        self.schema_cache = TTLCache(1, SCHEMA_CACHE_TTL)
+        self.result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.journal = get_query_journal() if JOURNAL_ENABLED else None
+        self.journal_scope = f"rag_pipeline|{self.client.project}|{BIGQUERY_DATASET_ID}"
+        self.num_sql_candidates = num_sql_candidates
+        self.rollups = RollupManager(
+            client=self.client,
+            project_id=BIGQUERY_PROJECT_ID,
+            dataset_id=BIGQUERY_DATASET_ID
+        ) if USE_ROLLUPS else None
+        if self.rollups:
+            try:
+                self.rollups.load_watermarks()
+            except Exception as e:
+                print(f"Rollup routing disabled, could not read watermarks: {str(e)}")
         
         # Initialize Gemini model with function calling
         self.tools = Tool(function_declarations=[
@@ -191,26 +692,67 @@ class RAGPipeline:
             tools=[self.tools]
         )
         
-    def process_query(self, user_query: str) -> str:
-        """Process user query through the RAG pipeline"""
-        
-        # 1. Intent Recognition & Context Enhancement
-        relevant_context = self._get_relevant_context(user_query)
-        
-        # 2. Generate SQL with enhanced context
-        sql_query = self._generate_sql(user_query, relevant_context)
-        
-        # 3. Execute and validate query
-        results = self._execute_query(sql_query)
-        
-        # 4. Generate natural language response
-        response = self._generate_response(user_query, sql_query, results)
-        
-        return response
+    def process_query(self, user_query: str, trace: Dict = None) -> str:
+        """
+        Process user query through the RAG pipeline. trace, if given, is
+        filled with this request's details: the SQL candidates raced
+        ("sql_candidates"), whether the result was "cached" and the
+        "bytes_processed" it scanned.
+        """
+        timings = {}
+        trace = {} if trace is None else trace
+        sql_query, error = "", None
+        try:
+            # 1. Intent Recognition & Context Enhancement
+            start = time.perf_counter()
+            relevant_context = self._get_relevant_context(user_query)
+            timings["context"] = time.perf_counter() - start
+            
+            # 2. Generate SQL with enhanced context
+            start = time.perf_counter()
+            if self.num_sql_candidates > 1:
+                sql_query = self._generate_sql_raced(user_query, relevant_context, trace)
+            else:
+                sql_query = self._generate_sql(user_query, relevant_context)
+            if self.rollups:
+                sql_query = self.rollups.route(sql_query)
+            timings["generate_sql"] = time.perf_counter() - start
+            
+            # 3. Execute and validate query
+            start = time.perf_counter()
+            results = self._execute_query(sql_query, trace)
+            timings["execute"] = time.perf_counter() - start
+            if isinstance(results, str):
+                error = results
+            
+            # 4. Generate natural language response
+            start = time.perf_counter()
+            response = self._generate_response(user_query, sql_query, results)
+            timings["respond"] = time.perf_counter() - start
+            
+            return response
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            # The journal writes on its own thread, so this does not add latency
+            if self.journal:
+                self.journal.record(
+                    user_query,
+                    sql_query,
+                    timings,
+                    trace.get("bytes_processed"),
+                    error,
+                    cached=trace.get("cached", False),
+                    scope=self.journal_scope
+                )
         
     def _get_relevant_context(self, query: str) -> Dict:
         """Get relevant context using vector similarity"""
-        similar_items = self.vector_db.similarity_search(query)
+        if HYBRID_RETRIEVAL:
+            similar_items = self.vector_db.hybrid_search(query)
+        else:
+            similar_items = self.vector_db.similarity_search(query)
         
         # Extract table and column information
         tables_info = self._get_tables_info()
@@ -222,6 +764,10 @@ class RAGPipeline:
         
     def _get_tables_info(self) -> Dict:
         """Get information about available tables"""
+        return self.schema_cache.get_or_compute("tables_info", self._fetch_tables_info)
+
+    def _fetch_tables_info(self) -> Dict:
+        """Read table and column information from INFORMATION_SCHEMA"""
         query = f"""
         SELECT 
             table_name,
@@ -231,7 +777,8 @@ class RAGPipeline:
         FROM `{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}.INFORMATION_SCHEMA.COLUMNS`
         """
         
-        results = self.client.query(query).result()
+        with self.admission.admit("bigquery"):
+            results = self.client.query(query).result()
         return {row['table_name']: dict(row) for row in results}
 
     def _generate_sql(
@@ -241,7 +788,33 @@ class RAGPipeline:
     ) -> str:
         """Generate SQL with enhanced context using function calling"""
         
-        chat = self.model.start_chat()
+        system_prompt, user_prompt = self._build_sql_prompts(user_query, context)
+        return self._send_prompt(system_prompt, user_prompt).strip()
+
+    def _send_prompt(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        admission_timeout: float = None,
+        **generation_config
+    ) -> str:
+        """Send one prompt to a fresh chat; identical concurrent prompts share a call"""
+        def send():
+            chat = self.model.start_chat()
+            kwargs = {"generation_config": generation_config} if generation_config else {}
+            with self.admission.admit("gemini", timeout=admission_timeout):
+                response = chat.send_message(
+                    content=user_prompt,
+                    context=system_prompt,
+                    **kwargs
+                )
+            return response.text
+        
+        key = prompt_key(system_prompt, user_prompt, sorted(generation_config.items()))
+        return self.model_flight.do(key, send)
+
+    def _build_sql_prompts(self, user_query: str, context: Dict) -> tuple:
+        """Build the system and user prompts for SQL generation"""
         system_prompt = (
             "You are a SQL expert. Generate a BigQuery SQL query based on:"
             "\n1) The user's question"
@@ -256,40 +829,233 @@ class RAGPipeline:
             f"RELEVANT CONTEXT:\n{context['similar_contexts']}"
         )
         
-        response = chat.send_message(
-            content=user_prompt,
-            context=system_prompt
-        )
+        return system_prompt, user_prompt
+
+    def _generate_sql_raced(self, user_query: str, context: Dict, trace: Dict = None) -> str:
+        """
+        Request several SQL candidates concurrently and return the cheapest
+        one that passes a dry run.
+
+        Candidates are validated as they arrive. Once the first valid one is
+        in, the remaining candidates get SQL_CANDIDATE_GRACE_SECONDS to beat
+        it on bytes processed. Candidates still outstanding are then told to
+        stop: they skip any Gemini call or dry run they have not yet been
+        admitted to, so losers do not hold or queue for admission slots.
+        If no candidate validates, the first one generated is returned so
+        the caller surfaces its error as before. The candidates are stored
+        in trace["sql_candidates"], since the pipeline is shared by users.
+        """
+        system_prompt, user_prompt = self._build_sql_prompts(user_query, context)
         
-        return response.text.strip()
+        executor = ThreadPoolExecutor(max_workers=self.num_sql_candidates)
+        cancelled = threading.Event()
+        pending = set()
+        for i in range(self.num_sql_candidates):
+            temperature = SQL_CANDIDATE_TEMPERATURES[i % len(SQL_CANDIDATE_TEMPERATURES)]
+            hint = SQL_CANDIDATE_HINTS[i % len(SQL_CANDIDATE_HINTS)]
+            pending.add(executor.submit(
+                self._generate_sql_candidate,
+                system_prompt,
+                user_prompt + hint,
+                temperature,
+                cancelled
+            ))
         
-    def _execute_query(self, query: str) -> Union[List[Dict], str]:
-        """Execute BigQuery SQL with error handling"""
+        candidates = []
+        deadline = None
         try:
-            query_job = self.client.query(query)
-            results = query_job.result()
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - time.time())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    candidates.append(future.result())
+                if deadline is None and any(c["error"] is None for c in candidates):
+                    deadline = time.time() + SQL_CANDIDATE_GRACE_SECONDS
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if trace is not None:
+            trace["sql_candidates"] = candidates
+        valid = [c for c in candidates if c["error"] is None]
+        if valid:
+            return min(valid, key=lambda c: c["bytes_processed"])["sql"]
+        generated = [c for c in candidates if c["sql"]]
+        if generated:
+            return generated[0]["sql"]
+        raise RuntimeError(f"All SQL candidates failed: {candidates[0]['error']}")
+
+    def _generate_sql_candidate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        cancelled: threading.Event = None
+    ) -> Dict:
+        """
+        Generate one SQL candidate and validate it with a dry run, giving up
+        before either step once cancelled is set
+        """
+        candidate = {
+            "sql": "",
+            "temperature": temperature,
+            "bytes_processed": None,
+            "error": None,
+        }
+        cancelled = cancelled or threading.Event()
+        try:
+            if cancelled.is_set():
+                candidate["error"] = "Cancelled"
+                return candidate
+            text = self._send_prompt(
+                system_prompt,
+                user_prompt,
+                admission_timeout=SQL_CANDIDATE_ADMISSION_TIMEOUT,
+                temperature=temperature
+            )
+            candidate["sql"] = self._clean_generated_sql(text)
+            
+            if not candidate["sql"].upper().startswith(("SELECT", "WITH")):
+                candidate["error"] = "Candidate is not a SELECT statement"
+            elif cancelled.is_set():
+                candidate["error"] = "Cancelled"
+            else:
+                candidate["bytes_processed"] = self._dry_run(
+                    candidate["sql"], timeout=SQL_CANDIDATE_ADMISSION_TIMEOUT
+                )
+        except Exception as e:
+            candidate["error"] = str(e)
+        return candidate
+
+    @staticmethod
+    def _clean_generated_sql(text: str) -> str:
+        """Strip markdown code fences and trailing semicolons from model output"""
+        sql = text.strip()
+        if sql.startswith("```"):
+            sql = sql.split("\n", 1)[1] if "\n" in sql else ""
+            sql = sql.rsplit("```", 1)[0]
+        return sql.strip().rstrip(";").strip()
+
+    def _dry_run(self, query: str, timeout: float = None) -> int:
+        """Validate a query without running it and return the bytes it would scan"""
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        with self.admission.admit("bigquery", timeout=timeout):
+            query_job = self.client.query(query, job_config=job_config)
+        return query_job.total_bytes_processed or 0
+        
+    def _execute_query(self, query: str, trace: Dict = None) -> Union[ResultSet, str]:
+        """
+        Execute BigQuery SQL with error handling. trace, if given, receives
+        "cached" and the "bytes_processed" this call scanned: 0 when the
+        result came from the cache or another user's job.
+        """
+        try:
+            # Recent identical SQL is served from cache; SQL already running
+            # for another user is joined rather than rerun
+            key = self._query_key(query)
+            executed = []
             
-            # Convert to list of dicts
-            rows = []
-            for row in results:
-                row_dict = {}
-                for key in row.keys():
-                    row_dict[key] = row[key]
-                rows.append(row_dict)
-            return rows
+            def run():
+                result_set = self._run_query(query)
+                executed.append(result_set)
+                return result_set
+            
+            results = self.result_cache.get_or_compute(
+                key,
+                lambda: self.query_flight.do(key, run)
+            )
+            if trace is not None:
+                trace["cached"] = not executed
+                trace["bytes_processed"] = results.bytes_processed if executed else 0
+            return results
             
         except Exception as e:
             return f"ERROR: {str(e)}"
+
+    def _query_key(self, query: str) -> str:
+        """Coalescing and cache key; other callers of the "bigquery" group return other types"""
+        return sql_key(query, "rag_pipeline", self.client.project, BIGQUERY_DATASET_ID)
+
+    def _run_query(self, query: str, priority: int = PRIORITY_INTERACTIVE) -> ResultSet:
+        """Run a query and collect the rows column-wise"""
+        with self.admission.admit("bigquery", priority=priority):
+            query_job = self.client.query(query)
+            results = query_job.result()
+        
+        result_set = ResultSet.from_bigquery(results)
+        result_set.bytes_processed = query_job.total_bytes_processed
+        return result_set
+
+    def warm_caches(self, limit: int = WARMUP_LIMIT) -> Dict:
+        """
+        Build the lexical index, then replay the most frequent recent journal
+        entries at batch priority to pre-populate the schema, embedding and
+        result caches
+        """
+        warmed = {"lexical_documents": 0, "entries": 0, "embeddings": 0, "results": 0}
+        if HYBRID_RETRIEVAL and self.vector_db.lexical_index is None:
+            # Otherwise the first hybrid_search scans the embeddings table
+            # inside a user's request
+            try:
+                warmed["lexical_documents"] = len(self.vector_db.load_lexical_index())
+            except Exception as e:
+                print(f"Skipped building the lexical index: {str(e)}")
+        if not self.journal:
+            return warmed
+        entries = self.journal.frequent_entries(limit, scope=self.journal_scope)
+        warmed["entries"] = len(entries)
+        if not entries:
+            return warmed
+        
+        self._get_tables_info()
+        try:
+            questions = [entry["question"] for entry in entries]
+            warmed["embeddings"] = len(self.vector_db.generate_embeddings(questions, priority=PRIORITY_BATCH))
+        except Exception as e:
+            print(f"Skipped warming embeddings: {str(e)}")
+        for entry in entries:
+            try:
+                if entry.get("sql"):
+                    sql = entry["sql"]
+                    self.result_cache.get_or_compute(
+                        self._query_key(sql),
+                        lambda: self._run_query(sql, priority=PRIORITY_BATCH)
+                    )
+                    warmed["results"] += 1
+            except Exception as e:
+                print(f"Skipped warming cache for {entry['question']!r}: {str(e)}")
+        return warmed
+            
+    def export_query(
+        self,
+        query: str,
+        path: str,
+        fmt: str = "csv",
+        page_size: int = EXPORT_PAGE_SIZE,
+        **options
+    ) -> int:
+        """Run a query and stream its results page by page to a CSV, Parquet or Arrow file"""
+        with self.admission.admit("bigquery"):
+            results = self.client.query(query).result(page_size=page_size)
+        if results.schema:
+            # Columns and their types come from BigQuery, not from whatever
+            # the first page holds, so empty results still export them
+            if fmt == "csv":
+                options.setdefault("fieldnames", [field.name for field in results.schema])
+            else:
+                options.setdefault("schema", bigquery_arrow_schema(results.schema))
+        return export_results(iter_bigquery_pages(results), path, fmt=fmt, **options)
             
     def _generate_response(
         self,
         user_query: str,
         sql: str,
-        results: List[Dict]
+        results: Union[ResultSet, str]
     ) -> str:
         """Generate natural language response using Gemini"""
         
-        chat = self.model.start_chat()
         system_prompt = (
             "You are a helpful assistant that explains query results in natural language."
             "Provide a clear, concise summary of the findings."
@@ -302,12 +1068,7 @@ class RAGPipeline:
             "Please summarize these results in natural language."
         )
         
-        response = chat.send_message(
-            content=user_prompt,
-            context=system_prompt
-        )
-        
-        return response.text.strip()
+        return self._send_prompt(system_prompt, user_prompt).strip()
 
 ###############################################################################
 # DEMO APPLICATION
@@ -326,6 +1087,12 @@ def main():
         print(f"Project: {BIGQUERY_PROJECT_ID}")
         print(f"Dataset: {BIGQUERY_DATASET_ID}\n")
         
+        if WARM_CACHES_ON_STARTUP:
+            warmed = pipeline.warm_caches()
+            print(f"Indexed {warmed['lexical_documents']} documents for lexical retrieval")
+            print(f"Warmed caches from {warmed['entries']} journal entries "
+                  f"({warmed['embeddings']} embeddings, {warmed['results']} results)\n")
+        
         # Example queries to try
         sample_queries = [
             "How many total records are in the database?",
@@ -363,7 +1130,7 @@ if __name__ == "__main__":
 # UTILITY FUNCTIONS
 ###############################################################################
 
-def format_bigquery_results(results: List[Dict]) -> str:
+def format_bigquery_results(results: Union[List[Dict], ResultSet]) -> str:
     """Format BigQuery results for better display"""
     if not results:
         return "No results found."
@@ -375,7 +1142,7 @@ def format_bigquery_results(results: List[Dict]) -> str:
     widths = {}
     for col in columns:
         widths[col] = max(
-            len(str(row[col])) for row in results + [{"col": col}]
+            len(col), max(len(str(row[col])) for row in results)
         )
         
     # Create header
@@ -0,0 +1,220 @@
+"""
+Query journal
+An append-only JSONL record of what users asked and how it was answered:
+1. Question, generated SQL, referenced tables, stage timings, bytes processed
+2. Writes happen on a background thread, off the request path
+3. Files are rotated by size (query_journal.jsonl, .1, .2, ...)
+4. The most frequent recent entries drive cache warm-up at startup
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+JOURNAL_PATH = "query_journal.jsonl"
+JOURNAL_MAX_BYTES = 10 * 1024 * 1024
+JOURNAL_BACKUPS = 5
+JOURNAL_QUEUE_SIZE = 10000   # entries beyond this are dropped rather than block requests
+WARMUP_WINDOW = 7 * 24 * 3600.0
+WARMUP_LIMIT = 20
+
+TABLE_PATTERN = re.compile(r"(?i)\b(?:from|join)\s+`?([\w\-]+(?:\.[\w\-]+){0,2})`?")
+STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+
+###############################################################################
+# HELPERS
+###############################################################################
+
+def _expression_spans(sql: str) -> List[tuple]:
+    """
+    Spans of parentheses that are not subqueries, e.g. the arguments of
+    EXTRACT(HOUR FROM ts) or TRIM(x FROM col), where FROM names no table
+    """
+    spans = []
+    stack = []
+    for i, char in enumerate(sql):
+        if char == "(":
+            subquery = re.match(r"\s*(?:select|with)\b", sql[i + 1:], re.IGNORECASE) is not None
+            stack.append((i, subquery))
+        elif char == ")" and stack:
+            start, subquery = stack.pop()
+            if not subquery:
+                spans.append((start, i))
+    return spans
+
+def referenced_tables(sql: str) -> List[str]:
+    """Table names that appear after FROM or JOIN, in order of first use"""
+    # Blank out string literals so their contents cannot match
+    sql = STRING_LITERAL.sub(lambda m: " " * len(m.group(0)), sql or "")
+    spans = _expression_spans(sql)
+    tables = []
+    for match in TABLE_PATTERN.finditer(sql):
+        if any(start < match.start() < end for start, end in spans):
+            continue
+        table = match.group(1)
+        if table not in tables and table.lower() != "unnest":
+            tables.append(table)
+    return tables
+
+###############################################################################
+# JOURNAL
+###############################################################################
+
+class QueryJournal:
+    """Size-rotated JSONL journal written by a background thread"""
+
+    def __init__(
+        self,
+        path: str = JOURNAL_PATH,
+        max_bytes: int = JOURNAL_MAX_BYTES,
+        backups: int = JOURNAL_BACKUPS
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=JOURNAL_QUEUE_SIZE)
+        self._writer = threading.Thread(target=self._write_loop, name="query-journal", daemon=True)
+        self._writer.start()
+
+    def record(
+        self,
+        question: str,
+        sql: str = "",
+        timings: Dict[str, float] = None,
+        bytes_processed: Optional[int] = None,
+        error: Optional[str] = None,
+        cached: bool = False,
+        scope: Optional[str] = None
+    ):
+        """
+        Queue an entry for writing; never blocks the caller. bytes_processed
+        is what this request scanned, so 0 when its result came from a cache
+        or another caller's job (cached=True). scope identifies the caller,
+        project and dataset, so warm-up only replays its own entries.
+        """
+        entry = {
+            "ts": time.time(),
+            "scope": scope,
+            "question": question,
+            "sql": sql,
+            "tables": referenced_tables(sql),
+            "timings": {stage: round(seconds, 4) for stage, seconds in (timings or {}).items()},
+            "bytes_processed": bytes_processed,
+            "cached": cached,
+            "error": error,
+        }
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Block until every queued entry has been written"""
+        self._queue.join()
+
+    def close(self):
+        """Write outstanding entries and stop the writer thread"""
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is None:
+                    return
+                self._rotate_if_needed()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, default=str) + "\n")
+            except Exception as e:
+                logger.warning(f"Failed to write query journal entry: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    def _rotate_if_needed(self):
+        """Shift path -> path.1 -> path.2 ... once path reaches max_bytes"""
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    ###########################################################################
+    # READING
+    ###########################################################################
+
+    def entries(self, since: Optional[float] = None) -> Iterator[Dict]:
+        """Journal entries from the oldest rotated file to the newest"""
+        paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)] + [self.path]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # partially written last line
+                    if since is None or entry.get("ts", 0) >= since:
+                        yield entry
+
+    def frequent_entries(
+        self,
+        limit: int = WARMUP_LIMIT,
+        window: float = WARMUP_WINDOW,
+        scope: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Most frequently asked recent questions, most frequent first, each
+        represented by its latest successful entry. With scope, only
+        entries recorded under that scope are considered.
+        """
+        counts: Counter = Counter()
+        latest: Dict[str, Dict] = {}
+        for entry in self.entries(since=time.time() - window):
+            if entry.get("error"):
+                continue
+            if scope is not None and entry.get("scope") != scope:
+                continue
+            key = " ".join(str(entry.get("question", "")).lower().split())
+            counts[key] += 1
+            latest[key] = entry
+        return [latest[key] for key, _ in counts.most_common(limit)]
+
+_journal = None
+_journal_lock = threading.Lock()
+
+def get_query_journal() -> QueryJournal:
+    """
+    Return the process-wide journal. Every pipeline and analyzer in the
+    process shares it, so one writer thread owns the file and its rotation.
+    The writer is a daemon thread, so queued entries are written out at exit.
+    """
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = QueryJournal()
+            atexit.register(_journal.close)
+        return _journal
@@ -0,0 +1,141 @@
+"""
+Lexical retrieval over stored context texts
+A small in-process BM25 inverted index used by the vector store to:
+1. Prefilter candidates before vector scoring
+2. Answer queries that name exact columns, tables or APIs without an
+   embedding call
+3. Fuse lexical and vector scores over the candidate set
+"""
+
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how",
+    "in", "is", "it", "me", "of", "on", "or", "show", "that", "the", "there",
+    "this", "to", "was", "what", "when", "where", "which", "who", "with",
+    "many", "much", "give", "list", "all", "my", "our", "do", "does",
+}
+
+###############################################################################
+# TOKENIZATION
+###############################################################################
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens. Identifiers such as api_status_monitoring or
+    dataset.table are kept whole and also split into their parts.
+    """
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9_.]+", text or ""):
+        word = word.strip(".").lower()
+        if not word or word in STOPWORDS:
+            continue
+        tokens.append(word)
+        pieces = word.split(".")
+        if len(pieces) > 1:
+            tokens.extend(p for p in pieces if p and p not in STOPWORDS)
+        for piece in pieces:
+            parts = [p for p in piece.split("_") if p and p not in STOPWORDS]
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+def is_identifier(token: str) -> bool:
+    """Whether a token looks like a column, table or API name"""
+    return "_" in token or "." in token or any(c.isdigit() for c in token)
+
+###############################################################################
+# BM25 INDEX
+###############################################################################
+
+class LexicalIndex:
+    """BM25 inverted index over documents addressed by their position"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_tokens: List[set] = []
+        self.doc_lengths: List[int] = []
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, texts: Sequence[str]):
+        """Index texts; document ids continue from the current size"""
+        for text in texts:
+            doc_id = len(self.doc_lengths)
+            counts = Counter(tokenize(text))
+            for token, tf in counts.items():
+                self.postings[token].append((doc_id, tf))
+            self.doc_tokens.append(set(counts))
+            length = sum(counts.values())
+            self.doc_lengths.append(length)
+            self.total_length += length
+
+    def idf(self, token: str) -> float:
+        df = len(self.postings.get(token, ()))
+        n = len(self.doc_lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_n: int = 50) -> List[Tuple[int, float]]:
+        """Top documents as (doc_id, score), best first"""
+        if not self.doc_lengths:
+            return []
+        avg_length = self.total_length / len(self.doc_lengths) or 1
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = self.idf(token)
+            for doc_id, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_n]
+
+    def strong_match(self, query: str, doc_id: int) -> bool:
+        """
+        Whether the query names identifiers that the index knows about and
+        the document contains every one of them
+        """
+        identifiers = {t for t in tokenize(query) if is_identifier(t) and t in self.postings}
+        return bool(identifiers) and identifiers <= self.doc_tokens[doc_id]
+
+###############################################################################
+# SCORE FUSION
+###############################################################################
+
+def fuse_scores(
+    lexical: Dict[int, float],
+    vector: Dict[int, float],
+    vector_weight: float = 0.7
+) -> List[Tuple[int, float]]:
+    """
+    Weighted sum of min-max normalized lexical and vector scores over the
+    union of both candidate sets, best first
+    """
+    def scaled(scores: Dict[int, float]) -> Dict[int, float]:
+        if not scores:
+            return {}
+        low, high = min(scores.values()), max(scores.values())
+        span = high - low
+        return {key: (value - low) / span if span else 1.0 for key, value in scores.items()}
+
+    lexical, vector = scaled(lexical), scaled(vector)
+    fused = {
+        key: vector_weight * vector.get(key, 0.0) + (1 - vector_weight) * lexical.get(key, 0.0)
+        for key in set(lexical) | set(vector)
+    }
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
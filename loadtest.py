@@ -0,0 +1,228 @@
+"""
+Concurrent-user load test for the NL to SQL Gradio app
+Launches gradioapp with local stand-in Gemini and BigQuery backends that
+follow the same function-calling sequence as the real ones, then drives N
+simulated users through the queued request path and reports, per
+concurrency level:
+1. Throughput (requests per second)
+2. Queue wait (time until the first streamed update)
+3. p50 / p99 end-to-end latency
+"""
+
+import argparse
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+from gradio_client import Client
+
+from admission import get_admission_controller
+from gradioapp import APP_CONCURRENCY_LIMIT, build_app
+from sqlexport import stream_format_results
+from testsql import DatabaseAnalyzer
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+DEFAULT_LEVELS = [1, 2, 4, 8, 16, 32]
+DEFAULT_REQUESTS_PER_USER = 5
+DEFAULT_MODEL_LATENCY = 0.2      # seconds per stand-in Gemini turn
+DEFAULT_BIGQUERY_LATENCY = 0.3   # seconds per stand-in query job
+
+STAND_IN_TABLE = "api_status_monitoring"
+STAND_IN_COLUMNS = ["timestamp", "api_name", "status"]
+STAND_IN_BYTES = 10485760  # reported as scanned by every stand-in query
+
+# Admission limits loose enough that the app, not the rate limiter, is measured
+STAND_IN_LIMITS = {
+    "rate": 1e6,
+    "burst": 1e6,
+    "concurrency": 1024,
+    "failure_threshold": 1000,
+    "reset_timeout": 1.0,
+}
+
+###############################################################################
+# STAND-IN BACKENDS
+###############################################################################
+
+def _model_response(part) -> SimpleNamespace:
+    """Wrap a part the way response.candidates[0].content.parts[0] is read"""
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+def _function_call(name: str, **args) -> SimpleNamespace:
+    return SimpleNamespace(function_call=SimpleNamespace(name=name, args=args))
+
+class StandInChat:
+    """Scripted chat: list_tables, get_table, sql_query, then a text answer"""
+
+    def __init__(self, latency: float, dataset_id: str):
+        self.latency = latency
+        self.dataset_id = dataset_id
+        self.turn = 0
+        self.question = ""
+
+    def send_message(self, content):
+        time.sleep(self.latency)
+        self.turn += 1
+        if self.turn == 1:
+            self.question = str(content).split("\n")[0]
+            return _model_response(_function_call("list_tables", dataset_id=self.dataset_id))
+        if self.turn == 2:
+            return _model_response(_function_call("get_table", table_id=f"{self.dataset_id}.{STAND_IN_TABLE}"))
+        if self.turn == 3:
+            # The question is part of the SQL so users do not coalesce onto one job
+            sql = (
+                f"SELECT status, COUNT(*) AS n FROM `{self.dataset_id}.{STAND_IN_TABLE}` "
+                f"WHERE api_name != '{abs(hash(self.question))}' GROUP BY status"
+            )
+            return _model_response(_function_call("sql_query", query=sql))
+        return _model_response(SimpleNamespace(text=f"Stand-in answer to: {self.question}"))
+
+class StandInModel:
+    def __init__(self, latency: float, dataset_id: str):
+        self.latency = latency
+        self.dataset_id = dataset_id
+
+    def start_chat(self) -> StandInChat:
+        return StandInChat(self.latency, self.dataset_id)
+
+class StandInRows(list):
+    """Rows with the schema attribute ResultSet.from_bigquery reads"""
+
+    schema = [SimpleNamespace(name="status"), SimpleNamespace(name="n")]
+
+class StandInBigQueryClient:
+    """Answers the analyzer's BigQuery calls after a fixed latency"""
+
+    def __init__(self, latency: float, project: str):
+        self.latency = latency
+        self.project = project
+
+    def list_tables(self, dataset_id):
+        return [SimpleNamespace(table_id=STAND_IN_TABLE)]
+
+    def get_table(self, table_id):
+        fields = [{"name": column} for column in STAND_IN_COLUMNS]
+        info = {"description": "Stand-in API status table", "schema": {"fields": fields}}
+        return SimpleNamespace(to_api_repr=lambda: info)
+
+    def query(self, query, job_config=None):
+        def result():
+            time.sleep(self.latency)
+            return StandInRows([
+                SimpleNamespace(values=lambda: ("SUCCESS", 950)),
+                SimpleNamespace(values=lambda: ("FAILURE", 50)),
+            ])
+        return SimpleNamespace(result=result, total_bytes_processed=STAND_IN_BYTES)
+
+def stand_in_factory(model_latency: float, bigquery_latency: float):
+    """analyzer_factory for gradioapp.build_app backed by stand-ins"""
+    def factory(project_id: str, dataset_id: str) -> DatabaseAnalyzer:
+        return DatabaseAnalyzer(
+            project_id=project_id,
+            dataset_id=dataset_id,
+            model=StandInModel(model_latency, dataset_id),
+            client=StandInBigQueryClient(bigquery_latency, project_id),
+            journal_enabled=False
+        )
+    return factory
+
+###############################################################################
+# LOAD GENERATOR
+###############################################################################
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def run_level(url: str, users: int, requests_per_user: int) -> Dict:
+    """Drive users concurrent clients, each sending requests back to back"""
+    latencies: List[float] = []
+    queue_waits: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def user(user_id: int):
+        client = Client(url, verbose=False)
+        for request_id in range(requests_per_user):
+            question = f"How many API calls failed? (user {user_id}, request {request_id})"
+            start = time.perf_counter()
+            first_update = None
+            try:
+                job = client.submit("load-test", "load_test", question, api_name="/answer")
+                for _ in job:
+                    if first_update is None:
+                        first_update = time.perf_counter()
+                job.result()
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                continue
+            end = time.perf_counter()
+            with lock:
+                latencies.append(end - start)
+                queue_waits.append((first_update or end) - start)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "users": users,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "queue_wait_p50": round(percentile(queue_waits, 0.50), 3),
+        "queue_wait_p99": round(percentile(queue_waits, 0.99), 3),
+        "latency_p50": round(percentile(latencies, 0.50), 3),
+        "latency_p99": round(percentile(latencies, 0.99), 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the NL to SQL Gradio app")
+    parser.add_argument("--levels", default=",".join(map(str, DEFAULT_LEVELS)),
+                        help="comma-separated numbers of concurrent users")
+    parser.add_argument("--requests-per-user", type=int, default=DEFAULT_REQUESTS_PER_USER)
+    parser.add_argument("--concurrency-limit", type=int, default=APP_CONCURRENCY_LIMIT)
+    parser.add_argument("--model-latency", type=float, default=DEFAULT_MODEL_LATENCY)
+    parser.add_argument("--bigquery-latency", type=float, default=DEFAULT_BIGQUERY_LATENCY)
+    parser.add_argument("--keep-rate-limits", action="store_true",
+                        help="apply the production admission limits to the stand-ins")
+    args = parser.parse_args()
+
+    if not args.keep_rate_limits:
+        controller = get_admission_controller()
+        controller.limits = {backend: dict(STAND_IN_LIMITS) for backend in controller.limits}
+
+    levels = [int(level) for level in args.levels.split(",")]
+    demo = build_app(
+        stand_in_factory(args.model_latency, args.bigquery_latency),
+        concurrency_limit=args.concurrency_limit,
+        max_queue_size=max(levels) * 2
+    )
+    _, url, _ = demo.launch(prevent_thread_lock=True, quiet=True)
+
+    print(f"Concurrency limit: {args.concurrency_limit}, "
+          f"model latency: {args.model_latency}s, BigQuery latency: {args.bigquery_latency}s\n")
+    try:
+        results = []
+        for users in levels:
+            results.append(run_level(url, users, args.requests_per_user))
+            print(f"  {users} users done")
+        print()
+        for line in stream_format_results(results):
+            print(line)
+    finally:
+        demo.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Compact quantized embeddings
+Vectors are normalized once at write time and stored as int8 codes with a
+per-vector scale (or as float16), so similarity is a single dot product:
+1. Quantize / dequantize helpers shared by the BigQuery and local stores
+2. A local in-memory index scoring over the quantized representation
+3. Recall of quantized search against the full-precision baseline
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+QUANTIZED_DTYPES = ("int8", "float16")
+INT8_OFFSET = 128          # int8 codes are stored as unsigned bytes (code + 128)
+SCORE_CHUNK_ROWS = 65536   # rows dequantized at a time while scoring
+
+###############################################################################
+# QUANTIZATION
+###############################################################################
+
+def normalize(vectors) -> np.ndarray:
+    """L2-normalize one vector or a matrix of row vectors"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def quantize(vectors, dtype: str = "int8") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Normalize and quantize row vectors.
+
+    Returns (codes, scales). For int8 each row is scaled so its largest
+    component maps to 127; for float16 the scales are all 1.
+    """
+    if dtype not in QUANTIZED_DTYPES:
+        raise ValueError(f"Unsupported quantized dtype: {dtype}")
+    unit = np.atleast_2d(normalize(vectors))
+    if dtype == "float16":
+        return unit.astype(np.float16), np.ones(len(unit), dtype=np.float32)
+
+    scales = np.abs(unit).max(axis=1) / 127
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    codes = np.clip(np.rint(unit / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """Recover approximate unit vectors from codes and scales"""
+    return codes.astype(np.float32) * scales[:, None]
+
+def int8_to_bytes(codes: np.ndarray) -> bytes:
+    """Pack one int8 vector as unsigned bytes, readable by TO_CODE_POINTS in BigQuery"""
+    return (codes.astype(np.int16) + INT8_OFFSET).astype(np.uint8).tobytes()
+
+def int8_from_bytes(data: bytes) -> np.ndarray:
+    """Inverse of int8_to_bytes"""
+    return (np.frombuffer(data, dtype=np.uint8).astype(np.int16) - INT8_OFFSET).astype(np.int8)
+
+###############################################################################
+# LOCAL INDEX
+###############################################################################
+
+class LocalVectorIndex:
+    """In-memory quantized vectors with dot-product top-k search"""
+
+    def __init__(self, dtype: str = "int8"):
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError(f"Unsupported quantized dtype: {dtype}")
+        self.dtype = dtype
+        self.codes = np.empty((0, 0), dtype=np.int8 if dtype == "int8" else np.float16)
+        self.scales = np.empty(0, dtype=np.float32)
+        self.items: List[Dict] = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the vector representation"""
+        return self.codes.nbytes + self.scales.nbytes
+
+    def add(self, vectors, items: Sequence[Dict]):
+        """Quantize full-precision vectors and add them with their items"""
+        codes, scales = quantize(vectors, self.dtype)
+        self.add_quantized(codes, scales, items)
+
+    def add_quantized(self, codes: np.ndarray, scales: np.ndarray, items: Sequence[Dict]):
+        """Add already-quantized vectors, e.g. loaded from the BigQuery table"""
+        if len(self.items) == 0:
+            self.codes = np.asarray(codes)
+            self.scales = np.asarray(scales, dtype=np.float32)
+        else:
+            self.codes = np.concatenate([self.codes, codes])
+            self.scales = np.concatenate([self.scales, scales])
+        self.items.extend(items)
+
+    def scores(self, query_vector, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Dot product of the normalized query with every stored vector, or only with rows"""
+        query = normalize(query_vector)
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            return (self.codes[rows].astype(np.float32) @ query) * self.scales[rows]
+        scores = np.empty(len(self.items), dtype=np.float32)
+        for start in range(0, len(self.items), SCORE_CHUNK_ROWS):
+            chunk = self.codes[start:start + SCORE_CHUNK_ROWS].astype(np.float32)
+            scores[start:start + SCORE_CHUNK_ROWS] = chunk @ query
+        return scores * self.scales
+
+    def search(self, query_vector, k: int = 5) -> List[Dict]:
+        """Top-k items by similarity, with a similarity_score field"""
+        if not self.items:
+            return []
+        scores = self.scores(query_vector)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.items[i], similarity_score=float(scores[i])) for i in top]
+
+###############################################################################
+# RECALL
+###############################################################################
+
+def measure_recall(vectors, queries, k: int = 5, dtype: str = "int8") -> Dict:
+    """
+    Compare quantized top-k search against the full-precision baseline.
+
+    Returns mean recall@k over the queries and the per-vector storage of
+    both representations (float64, as in ARRAY<FLOAT64>, versus quantized).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.atleast_2d(normalize(queries))
+    baseline = normalize(vectors)
+
+    index = LocalVectorIndex(dtype)
+    index.add(vectors, [{"row": i} for i in range(len(vectors))])
+    k = min(k, len(vectors))
+
+    hits = 0
+    for query in queries:
+        exact = set(np.argsort(-(baseline @ query))[:k])
+        approx = {item["row"] for item in index.search(query, k)}
+        hits += len(exact & approx)
+
+    dims = vectors.shape[1] if vectors.ndim == 2 else 0
+    return {
+        "dtype": dtype,
+        "k": k,
+        "queries": len(queries),
+        "recall": hits / (k * len(queries)) if len(queries) and k else 0.0,
+        "full_bytes_per_vector": dims * 8,
+        "quantized_bytes_per_vector": index.nbytes / max(len(index), 1),
+    }
@@ -0,0 +1,200 @@
+"""
+Columnar query results
+ResultSet keeps each column in a single NumPy array under a shared list of
+column names instead of a list of per-row dicts:
+1. Numeric and boolean columns are stored unboxed, with a validity mask
+   when they contain NULLs
+2. Rows are lazy views that read from the column arrays
+3. Slicing returns a new ResultSet over views of the same arrays (no copy)
+4. Cheap conversion to pandas and Arrow
+"""
+
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+import numpy as np
+
+###############################################################################
+# COLUMN HELPERS
+###############################################################################
+
+UNBOXED_DTYPES = {bool: np.bool_, int: np.int64, float: np.float64}
+
+def _to_array(values: Sequence[Any]) -> np.ndarray:
+    """
+    Store a column unboxed when every non-NULL value is a bool, every one an
+    int or every one a float. NULLs (BigQuery columns are nullable) become
+    masked entries of a MaskedArray rather than boxing the column. Mixed
+    columns (SQLite is dynamically typed) stay boxed so 1 is not turned
+    into 1.0.
+    """
+    kinds = {type(v) for v in values}
+    nulls = type(None) in kinds
+    kinds.discard(type(None))
+    if len(kinds) == 1 and next(iter(kinds)) in UNBOXED_DTYPES:
+        kind = next(iter(kinds))
+        try:
+            if not nulls:
+                return np.array(values, dtype=UNBOXED_DTYPES[kind])
+            mask = np.fromiter((v is None for v in values), dtype=np.bool_, count=len(values))
+            data = np.array([kind() if v is None else v for v in values], dtype=UNBOXED_DTYPES[kind])
+            return np.ma.MaskedArray(data, mask=mask)
+        except OverflowError:
+            pass
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+def _to_python(value: Any) -> Any:
+    """Unbox NumPy scalars and masked NULLs so rows print and serialize like plain values"""
+    if value is np.ma.masked:
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+###############################################################################
+# ROW VIEW
+###############################################################################
+
+class RowView(Mapping):
+    """Read-only mapping over one row of a ResultSet"""
+
+    __slots__ = ("_result", "_index")
+
+    def __init__(self, result: "ResultSet", index: int):
+        self._result = result
+        self._index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return _to_python(self._result._data[key][self._index])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._result.columns)
+
+    def __len__(self) -> int:
+        return len(self._result.columns)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+###############################################################################
+# RESULT SET
+###############################################################################
+
+class ResultSet:
+    """Immutable column-wise query result with lazy row access"""
+
+    def __init__(self, columns: Sequence[str], data: Dict[str, np.ndarray]):
+        self.columns = list(columns)
+        self._data = data
+        self._length = len(data[self.columns[0]]) if self.columns else 0
+        self.bytes_processed = None  # set by callers that know it, e.g. from the query job
+
+    @classmethod
+    def from_columns(cls, columns: Sequence[str], values: Sequence[Sequence[Any]]) -> "ResultSet":
+        """Build from one sequence of values per column"""
+        return cls(columns, {name: _to_array(col) for name, col in zip(columns, values)})
+
+    @classmethod
+    def from_records(cls, columns: Sequence[str], records: Iterable[Sequence[Any]]) -> "ResultSet":
+        """Build from row tuples in column order, e.g. DB-API cursor rows"""
+        values = [[] for _ in columns]
+        for record in records:
+            for column_values, value in zip(values, record):
+                column_values.append(value)
+        return cls.from_columns(columns, values)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Mapping]) -> "ResultSet":
+        """Build from dict-like rows; the first row fixes the columns"""
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return cls([], {})
+        columns = list(first.keys())
+        return cls.from_records(
+            columns,
+            ([row[c] for c in columns] for row in _chain_first(first, rows))
+        )
+
+    @classmethod
+    def from_bigquery(cls, row_iterator) -> "ResultSet":
+        """Build from a BigQuery RowIterator, column names taken from its schema"""
+        columns = [field.name for field in (row_iterator.schema or [])]
+        if not columns:
+            return cls.from_rows(dict(row) for row in row_iterator)
+        return cls.from_records(columns, (row.values() for row in row_iterator))
+
+    @classmethod
+    def from_cursor(cls, cursor) -> "ResultSet":
+        """Build from an executed DB-API cursor such as sqlite3"""
+        columns = [description[0] for description in cursor.description or []]
+        return cls.from_records(columns, cursor.fetchall())
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __iter__(self) -> Iterator[RowView]:
+        for i in range(self._length):
+            yield RowView(self, i)
+
+    def __getitem__(self, index):
+        """Integer index gives a RowView; a slice gives a zero-copy ResultSet"""
+        if isinstance(index, slice):
+            return ResultSet(self.columns, {name: col[index] for name, col in self._data.items()})
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("ResultSet index out of range")
+        return RowView(self, index)
+
+    def column(self, name: str) -> np.ndarray:
+        """The backing array of one column; a MaskedArray if it holds NULLs"""
+        return self._data[name]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Materialize as a list of plain dicts"""
+        return [dict(row) for row in self]
+
+    def iter_pages(self, page_size: int) -> Iterator["ResultSet"]:
+        """Zero-copy slices of at most page_size rows, e.g. for sqlexport writers"""
+        for start in range(0, self._length, page_size):
+            yield self[start:start + page_size]
+
+    def to_pandas(self):
+        """Convert to a pandas DataFrame; columns with NULLs use nullable dtypes"""
+        import pandas as pd
+
+        def series(col):
+            if isinstance(col, np.ma.MaskedArray):
+                nullable = {
+                    "b": pd.arrays.BooleanArray,
+                    "i": pd.arrays.IntegerArray,
+                    "f": pd.arrays.FloatingArray,
+                }[col.dtype.kind]
+                return nullable(col.data, np.ma.getmaskarray(col))
+            return col
+
+        return pd.DataFrame({name: series(self._data[name]) for name in self.columns}, columns=self.columns)
+
+    def to_arrow(self):
+        """Convert to a pyarrow Table"""
+        import pyarrow as pa
+
+        def array(col):
+            if isinstance(col, np.ma.MaskedArray):
+                return pa.array(col.data, mask=np.ma.getmaskarray(col))
+            return pa.array(col)
+
+        return pa.table({name: array(self._data[name]) for name in self.columns})
+
+    def __repr__(self) -> str:
+        return repr(self.to_dicts())
+
+    __str__ = __repr__
+
+def _chain_first(first, rest):
+    yield first
+    yield from rest
@@ -0,0 +1,527 @@
+"""
+Pre-aggregated rollups for monitoring data
+Most questions about api_status_monitoring are counts and percentages by
+status, API and time bucket. This module:
+1. Maintains per-minute/hour/day count tables in BigQuery or SQLite
+2. Refreshes them incrementally from the last (possibly partial) bucket
+3. Rewrites eligible generated SQL to read the smallest sufficient rollup,
+   topped up with source rows newer than the rollup's watermark when the
+   source is partitioned on its timestamp (so the top-up scans only the
+   newest partitions)
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+from admission import PRIORITY_BATCH, get_admission_controller
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+ROLLUP_SOURCE_TABLE = "api_status_monitoring"
+ROLLUP_TIMESTAMP_COLUMN = "timestamp"        # adjust to the table's event time column
+ROLLUP_DIMENSIONS = ["api_name", "status"]   # columns kept in every rollup
+ROLLUP_GRANULARITIES = ["minute", "hour", "day"]
+GRANULARITY_ORDER = {"minute": 0, "hour": 1, "day": 2}
+
+# Without timestamp partitioning on the source, topping a rollup up with new
+# rows scans the whole source and costs more than the original query. Then
+# queries are only routed if answers may lag the source by up to the refresh
+# interval (rows since the last refresh() are not counted).
+ROLLUP_SERVE_STALE = False
+
+# Rollup that can answer a query bucketed at the given time unit
+UNIT_TO_GRANULARITY = {
+    "MINUTE": "minute",
+    "HOUR": "hour",
+    "DAY": "day",
+    "WEEK": "day",
+    "ISOWEEK": "day",
+    "MONTH": "day",
+    "QUARTER": "day",
+    "YEAR": "day",
+    "ISOYEAR": "day",
+    "DATE": "day",
+    "DAYOFWEEK": "day",
+}
+
+BUCKET_EXPRESSIONS = {
+    "bigquery": {
+        "minute": "TIMESTAMP_TRUNC({col}, MINUTE)",
+        "hour": "TIMESTAMP_TRUNC({col}, HOUR)",
+        "day": "TIMESTAMP_TRUNC({col}, DAY)",
+    },
+    "sqlite": {
+        "minute": "strftime('%Y-%m-%d %H:%M:00', {col})",
+        "hour": "strftime('%Y-%m-%d %H:00:00', {col})",
+        "day": "strftime('%Y-%m-%d 00:00:00', {col})",
+    },
+}
+
+# Words that may appear in a routable query besides dimensions and aliases
+ALLOWED_SQL_WORDS = {
+    "select", "from", "where", "group", "by", "order", "having", "limit", "as",
+    "and", "or", "not", "in", "is", "null", "like", "between", "asc", "desc",
+    "case", "when", "then", "else", "end", "true", "false", "if", "interval",
+    "over", "partition", "sum", "round", "safe_divide",
+    "cast", "float64", "int64", "numeric", "string", "timestamp", "date",
+    "lower", "upper", "coalesce", "ifnull", "current_timestamp", "current_date",
+    "timestamp_sub", "timestamp_add", "date_sub", "date_add", "timestamp_trunc",
+    "date_trunc", "extract", "format_timestamp",
+} | {unit.lower() for unit in UNIT_TO_GRANULARITY} | {"second", "millisecond", "microsecond"}
+
+# Constructs whose results change when computed over pre-aggregated rows
+DISALLOWED_PATTERNS = [
+    r"(?:\bselect|,)\s*\*",
+    r"\bjoin\b",
+    r"\bunion\b",
+    r"\bdistinct\b",
+    r"\bselect\b[\s\S]*\bselect\b",
+    r"\bcount\s*\(\s*(?!\*\s*\)|1\s*\))",
+    r"\bsum\s*\(\s*(?!count\s*\(|countif\s*\()",
+]
+
+# A timestamp literal; bounds must be whole buckets in UTC to be exact
+TIMESTAMP_LITERAL = re.compile(
+    r"^(\d{4}-\d{2}-\d{2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?)?"
+    r"\s*(?:Z|UTC|[+-]00(?::?00)?)?$",
+    re.IGNORECASE
+)
+
+###############################################################################
+# ROLLUP MANAGER
+###############################################################################
+
+class RollupManager:
+    """Builds, refreshes and routes queries to pre-aggregated rollup tables"""
+
+    def __init__(
+        self,
+        use_bigquery: bool = True,
+        client=None,
+        conn=None,
+        project_id: str = "",
+        dataset_id: str = "",
+        source_table: str = ROLLUP_SOURCE_TABLE,
+        timestamp_column: str = ROLLUP_TIMESTAMP_COLUMN,
+        dimensions: List[str] = None,
+        granularities: List[str] = None
+    ):
+        self.use_bigquery = use_bigquery
+        self.dialect = "bigquery" if use_bigquery else "sqlite"
+        self.client = client
+        self.conn = conn
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.source_table = source_table
+        self.timestamp_column = timestamp_column
+        self.dimensions = list(dimensions or ROLLUP_DIMENSIONS)
+        self.granularities = list(granularities or ROLLUP_GRANULARITIES)
+        self.stats = {"considered": 0, "routed": 0}
+        # Start of the newest (possibly partial) bucket of each rollup; rows
+        # from here on are read from the source table when routing
+        self.watermarks: Dict[str, object] = {}
+        # Whether the source is partitioned on timestamp_column; read with
+        # the watermarks
+        self.source_partitioned = False
+
+    def table_name(self, granularity: Optional[str] = None) -> str:
+        """Fully qualified name of the source table or one of its rollups"""
+        name = self.source_table
+        if granularity:
+            name = f"{name}_rollup_{granularity}"
+        if self.use_bigquery:
+            return f"`{self.project_id}.{self.dataset_id}.{name}`"
+        return name
+
+    def _execute(self, statement: str):
+        """Run a statement on the configured engine"""
+        if self.use_bigquery:
+            with get_admission_controller().admit("bigquery", priority=PRIORITY_BATCH):
+                return self.client.query(statement).result()
+        cursor = self.conn.cursor()
+        cursor.executescript(statement)
+        self.conn.commit()
+        return cursor
+
+    def _aggregate_select(self, granularity: str, where: str = "") -> str:
+        """SELECT that aggregates source rows into one rollup granularity"""
+        bucket = BUCKET_EXPRESSIONS[self.dialect][granularity].format(col=self.timestamp_column)
+        dims = ", ".join(self.dimensions)
+        return (
+            f"SELECT {bucket} AS bucket, {dims}, COUNT(*) AS row_count "
+            f"FROM {self.table_name()} {where} "
+            f"GROUP BY bucket, {dims}"
+        )
+
+    def create_tables(self):
+        """Create any missing rollup tables, fully populated from the source"""
+        for granularity in self.granularities:
+            statement = (
+                f"CREATE TABLE IF NOT EXISTS {self.table_name(granularity)} "
+            )
+            if self.use_bigquery:
+                statement += (
+                    "PARTITION BY DATE(bucket) "
+                    f"CLUSTER BY {', '.join(self.dimensions[:4])} "
+                )
+            statement += f"AS {self._aggregate_select(granularity)}"
+            self._execute(statement)
+        if self.use_bigquery:
+            self.load_watermarks()
+
+    def load_watermarks(self) -> Dict[str, object]:
+        """
+        Read each rollup's newest bucket, and whether the source is partitioned
+        on the timestamp; routing is disabled until this runs
+        """
+        source = self.client.get_table(f"{self.project_id}.{self.dataset_id}.{self.source_table}")
+        partitioning = source.time_partitioning
+        self.source_partitioned = partitioning is not None and partitioning.field == self.timestamp_column
+        statement = " UNION ALL ".join(
+            f"SELECT '{gran}' AS granularity, MAX(bucket) AS watermark FROM {self.table_name(gran)}"
+            for gran in self.granularities
+        )
+        self.watermarks = {
+            row["granularity"]: row["watermark"]
+            for row in self._execute(statement)
+            if row["watermark"] is not None
+        }
+        return self.watermarks
+
+    def refresh(self, granularity: Optional[str] = None):
+        """
+        Incrementally refresh one or all rollups.
+
+        The most recent bucket may have been partial when it was written, so
+        it is deleted and recomputed together with everything newer.
+        """
+        for gran in [granularity] if granularity else self.granularities:
+            rollup = self.table_name(gran)
+            if self.use_bigquery:
+                watermark = f"(SELECT IFNULL(MAX(bucket), TIMESTAMP '1970-01-01') FROM {rollup})"
+                statement = (
+                    f"DECLARE watermark TIMESTAMP DEFAULT {watermark};\n"
+                    f"DELETE FROM {rollup} WHERE bucket >= watermark;\n"
+                    f"INSERT INTO {rollup} (bucket, {', '.join(self.dimensions)}, row_count) "
+                    f"{self._aggregate_select(gran, f'WHERE {self.timestamp_column} >= watermark')};"
+                )
+                self._execute(statement)
+            else:
+                # SQLite has no script variables, so read the watermark first
+                cursor = self.conn.cursor()
+                cursor.execute(f"SELECT MAX(bucket) FROM {rollup}")
+                watermark = cursor.fetchone()[0] or "1970-01-01 00:00:00"
+                cursor.execute(f"DELETE FROM {rollup} WHERE bucket >= ?", (watermark,))
+                cursor.execute(
+                    f"INSERT INTO {rollup} (bucket, {', '.join(self.dimensions)}, row_count) "
+                    f"{self._aggregate_select(gran, f'WHERE {self.timestamp_column} >= ?')}",
+                    (watermark,)
+                )
+                self.conn.commit()
+        if self.use_bigquery:
+            self.load_watermarks()
+
+    ###########################################################################
+    # QUERY ROUTING
+    ###########################################################################
+
+    def route(self, sql: str) -> str:
+        """Return sql rewritten against the smallest sufficient rollup, or unchanged"""
+        self.stats["considered"] += 1
+        rewritten = self.rewrite(sql)
+        if rewritten is None:
+            return sql
+        self.stats["routed"] += 1
+        return rewritten
+
+    def rewrite(self, sql: str) -> Optional[str]:
+        """
+        Rewrite a count-style query over the source table to use a rollup.
+
+        Eligible queries read only the source table, reference only rollup
+        dimensions and the timestamp column, and aggregate with COUNT(*) or
+        COUNTIF over dimensions. The timestamp may be grouped through
+        TIMESTAMP_TRUNC, DATE or EXTRACT. The raw timestamp may only appear
+        in WHERE as `>=` or `<` against a bound that falls on a bucket
+        boundary (a literal, or TIMESTAMP_TRUNC/TIMESTAMP_SUB of one), since
+        any other bound would cut a bucket in two.
+
+        The rollup is read up to its watermark and the rest is aggregated
+        from the source table on the fly, so rows newer than the last
+        refresh are still counted; this needs the source partitioned on the
+        timestamp, see ROLLUP_SERVE_STALE. Returns None for anything else.
+        """
+        if not self.use_bigquery:
+            return None
+        if not (self.source_partitioned or ROLLUP_SERVE_STALE):
+            return None
+
+        masked, literals = _mask_string_literals(sql)
+        table_ref = re.compile(
+            r"`?(?:[\w-]+\.)?(?:\w+\.)?" + re.escape(self.source_table) + r"`?(?![\w.])"
+        )
+        if len(table_ref.findall(masked)) != 1:
+            return None
+        lowered = masked.lower()
+        if any(re.search(pattern, lowered) for pattern in DISALLOWED_PATTERNS):
+            return None
+
+        # Window functions without GROUP BY return one row per source row
+        if re.search(r"\bover\b", lowered) and not re.search(r"\bgroup\s+by\b", lowered):
+            return None
+
+        rewritten, granularity = self._rewrite_timestamps(masked, literals)
+        if rewritten is None or granularity not in self.watermarks:
+            return None
+        # SUM over no rows is NULL where COUNT is 0
+        rewritten, counts = re.subn(
+            r"(?i)\bcount\s*\(\s*(?:\*|1)\s*\)", "COALESCE(SUM(row_count), 0)", rewritten
+        )
+        rewritten, countifs = _rewrite_countifs(rewritten)
+        if rewritten is None or counts + countifs == 0:
+            # Plain row selections would return bucket rows instead of events
+            return None
+
+        body = table_ref.sub(" ", rewritten)
+        aliases = {a.lower() for a in re.findall(r"(?i)\bas\s+(\w+)", body)}
+        allowed = ALLOWED_SQL_WORDS | aliases | {"bucket", "row_count"} | {
+            d.lower() for d in self.dimensions
+        }
+        words = re.findall(r"\b[A-Za-z_]\w*\b", re.sub(r"__STR\d+__", " ", body))
+        if any(word.lower() not in allowed for word in words):
+            return None
+
+        source = self._fresh_rollup(granularity)
+        rewritten = table_ref.sub(lambda match: source, rewritten, count=1)
+        return _unmask_string_literals(rewritten, literals)
+
+    def _fresh_rollup(self, granularity: str) -> str:
+        """
+        Derived table with the rollup's columns: complete buckets from the
+        rollup, plus the watermark bucket onwards aggregated from the source.
+        If the source is not partitioned on the timestamp, just the rollup.
+        """
+        if not self.source_partitioned:
+            return self.table_name(granularity)
+        watermark = f"TIMESTAMP '{self.watermarks[granularity].isoformat()}'"
+        dims = ", ".join(self.dimensions)
+        tail = self._aggregate_select(granularity, f"WHERE {self.timestamp_column} >= {watermark}")
+        return (
+            f"(SELECT bucket, {dims}, row_count FROM {self.table_name(granularity)} "
+            f"WHERE bucket < {watermark} UNION ALL {tail})"
+        )
+
+    def _rewrite_timestamps(self, sql: str, literals: Dict[str, str]) -> Tuple[Optional[str], str]:
+        """Map timestamp expressions onto the bucket column and pick a granularity"""
+        col = re.escape(self.timestamp_column)
+        required = []
+
+        def trunc(match):
+            unit = match.group(1).upper()
+            if unit not in UNIT_TO_GRANULARITY:
+                raise ValueError(unit)
+            required.append(UNIT_TO_GRANULARITY[unit])
+            return f"TIMESTAMP_TRUNC(bucket, {match.group(1)})"
+
+        def extract(match):
+            unit = match.group(1).upper()
+            if unit not in UNIT_TO_GRANULARITY:
+                raise ValueError(unit)
+            required.append(UNIT_TO_GRANULARITY[unit])
+            return f"EXTRACT({match.group(1)} FROM bucket)"
+
+        def date(match):
+            required.append("day")
+            return "DATE(bucket)"
+
+        try:
+            sql = re.sub(rf"(?i)\btimestamp_trunc\s*\(\s*{col}\s*,\s*(\w+)\s*\)", trunc, sql)
+            sql = re.sub(rf"(?i)\bextract\s*\(\s*(\w+)\s+from\s+{col}\s*\)", extract, sql)
+            sql = re.sub(rf"(?i)\bdate\s*\(\s*{col}\s*\)", date, sql)
+        except ValueError:
+            return None, ""
+
+        # A remaining raw reference is only acceptable as a WHERE range filter
+        # against a bucket-aligned bound: ts >= X, ts < X, X <= ts or X > ts
+        raw = re.compile(rf"(?i)(?<!as )\b{col}\b(?!\s*__STR)")
+        if raw.search(sql):
+            where = re.search(r"(?is)\bwhere\b(.*?)(\bgroup\b|\border\b|\blimit\b|$)", sql)
+            if not where:
+                return None, ""
+            clause = where.group(1)
+            pieces = []
+            last = 0
+            for match in raw.finditer(clause):
+                right = re.match(r"\s*(?:>=|<(?![=>]))", clause[match.end():])
+                left = re.search(r"(?:<=|(?<![<>=!])>)\s*$", clause[:match.start()])
+                if right:
+                    operand = _operand_after(clause, match.end() + right.end())
+                elif left:
+                    operand = _operand_before(clause, left.start())
+                else:
+                    return None, ""
+                alignment = _bound_alignment(operand, literals) if operand else None
+                if alignment is None:
+                    return None, ""
+                required.append(alignment)
+                pieces.append(clause[last:match.start()] + "bucket")
+                last = match.end()
+            clause = "".join(pieces) + clause[last:]
+            sql = sql[:where.start(1)] + clause + sql[where.end(1):]
+            if raw.search(sql):
+                return None, ""
+
+        # Coarsest rollup that is still at least as fine as every requirement
+        finest_required = min((GRANULARITY_ORDER[r] for r in required), default=len(GRANULARITY_ORDER))
+        candidates = [g for g in self.granularities if GRANULARITY_ORDER[g] <= finest_required]
+        if not candidates:
+            return None, ""
+        return sql, max(candidates, key=GRANULARITY_ORDER.get)
+
+###############################################################################
+# UTILITY FUNCTIONS
+###############################################################################
+
+def _mask_string_literals(sql: str) -> Tuple[str, Dict[str, str]]:
+    """Replace quoted string literals with placeholders so rewrites skip them"""
+    literals = {}
+
+    def mask(match):
+        key = f"__STR{len(literals)}__"
+        literals[key] = match.group(0)
+        return key
+
+    masked = re.sub(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"", mask, sql)
+    return masked, literals
+
+def _closing_paren(sql: str, start: int) -> int:
+    """Index of the parenthesis closing the one at start, or -1"""
+    depth = 0
+    for i in range(start, len(sql)):
+        if sql[i] == "(":
+            depth += 1
+        elif sql[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+def _rewrite_countifs(sql: str) -> Tuple[Optional[str], int]:
+    """
+    COUNTIF(cond) -> COALESCE(SUM(IF(cond, row_count, 0)), 0), with nested
+    parentheses in cond. Returns (None, 0) if any COUNTIF cannot be rewritten.
+    """
+    pattern = re.compile(r"(?i)\bcountif\s*\(")
+    rewritten = 0
+    while True:
+        match = pattern.search(sql)
+        if not match:
+            return sql, rewritten
+        close = _closing_paren(sql, match.end() - 1)
+        if close < 0:
+            return None, 0
+        condition = sql[match.end():close]
+        sql = f"{sql[:match.start()]}COALESCE(SUM(IF({condition}, row_count, 0)), 0){sql[close + 1:]}"
+        rewritten += 1
+
+def _operand_after(sql: str, pos: int) -> Optional[str]:
+    """The bound expression starting at pos: a literal or a function call"""
+    match = re.match(r"\s*((?i:timestamp)\s*__STR\d+__|__STR\d+__|\w+\s*\()", sql[pos:])
+    if not match:
+        return None
+    start = pos + match.start(1)
+    if not match.group(1).endswith("("):
+        return sql[start:pos + match.end(1)]
+    close = _closing_paren(sql, pos + match.end(1) - 1)
+    return sql[start:close + 1] if close >= 0 else None
+
+def _operand_before(sql: str, end: int) -> Optional[str]:
+    """The bound expression ending just before end (ignoring whitespace)"""
+    text = sql[:end].rstrip()
+    literal = re.search(r"((?i:timestamp)\s*)?__STR\d+__$", text)
+    if literal:
+        return literal.group(0)
+    if not text.endswith(")"):
+        return None
+    depth = 0
+    for i in range(len(text) - 1, -1, -1):
+        if text[i] == ")":
+            depth += 1
+        elif text[i] == "(":
+            depth -= 1
+            if depth == 0:
+                name = re.search(r"\w+\s*$", text[:i])
+                return text[name.start():] if name else None
+    return None
+
+def _literal_alignment(value: str) -> Optional[str]:
+    """Coarsest granularity a UTC timestamp literal falls on a boundary of"""
+    match = TIMESTAMP_LITERAL.match(value.strip("'\"").strip())
+    if not match:
+        return None
+    _, hour, minute, second, fraction = match.groups()
+    if int(second or 0) or int(fraction or 0):
+        return None
+    if int(minute or 0):
+        return "minute"
+    if int(hour or 0):
+        return "hour"
+    return "day"
+
+def _bound_alignment(expr: str, literals: Dict[str, str]) -> Optional[str]:
+    """
+    Coarsest granularity whose bucket boundaries expr always falls on, or
+    None if it may fall inside a bucket (e.g. CURRENT_TIMESTAMP() minus
+    90 seconds)
+    """
+    expr = expr.strip()
+    literal = re.fullmatch(r"(?i)(?:timestamp\s*)?(?:\(\s*)?(__STR\d+__)(?:\s*\))?", expr)
+    if literal:
+        return _literal_alignment(literals[literal.group(1)])
+
+    call = re.match(r"(\w+)\s*\(", expr)
+    if not call or _closing_paren(expr, call.end() - 1) != len(expr) - 1:
+        return None
+    name = call.group(1).lower()
+    args = _split_args(expr[call.end():-1])
+
+    if name == "timestamp_trunc" and len(args) == 2:
+        return UNIT_TO_GRANULARITY.get(args[1].strip().upper())
+    if name in ("timestamp_sub", "timestamp_add") and len(args) == 2:
+        base = _bound_alignment(args[0], literals)
+        interval = re.fullmatch(r"(?i)\s*interval\s+\d+\s+(\w+)\s*", args[1])
+        step = UNIT_TO_GRANULARITY.get(interval.group(1).upper()) if interval else None
+        if base is None or step is None:
+            return None
+        return min(base, step, key=GRANULARITY_ORDER.get)
+    if name == "timestamp" and len(args) == 1:
+        # A DATE converted to TIMESTAMP is midnight UTC
+        if re.match(r"(?i)\s*(?:current_date\b|date_sub\s*\(|date_add\s*\(|date_trunc\s*\()", args[0]):
+            return "day"
+    return None
+
+def _split_args(args: str) -> List[str]:
+    """Split a function's argument list on top-level commas"""
+    parts = []
+    depth = 0
+    current = ""
+    for char in args:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+    return parts
+
+def _unmask_string_literals(sql: str, literals: Dict[str, str]) -> str:
+    """Restore string literals replaced by _mask_string_literals"""
+    for key, literal in literals.items():
+        sql = sql.replace(key, literal)
+    return sql
@@ -0,0 +1,183 @@
+"""
+Single-flight coalescing of identical in-flight calls
+When several users ask the same thing at once, only the first caller runs
+the BigQuery job or model call; concurrent duplicates wait for it and share
+its result (or its exception):
+1. Keys from comment/whitespace/keyword-normalized SQL, scoped to the caller
+2. Keys from hashed model prompts
+3. Metrics on how many calls were saved
+"""
+
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Callable, Dict
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+# BigQuery reserved keywords: they cannot be unquoted identifiers, so their
+# case never changes a query's meaning. Anything else (table and dataset
+# names, column names and aliases) is kept verbatim: BigQuery table names
+# are case-sensitive and column spelling becomes the result's column names.
+SQL_KEYWORDS = {
+    "all", "and", "any", "array", "as", "asc", "assert_rows_modified", "at",
+    "between", "by", "case", "cast", "collate", "contains", "create", "cross",
+    "cube", "current", "default", "define", "desc", "distinct", "else", "end",
+    "enum", "escape", "except", "exclude", "exists", "extract", "false",
+    "fetch", "following", "for", "from", "full", "group", "grouping",
+    "groups", "hash", "having", "if", "ignore", "in", "inner", "intersect",
+    "interval", "into", "is", "join", "lateral", "left", "like", "limit",
+    "lookup", "merge", "natural", "new", "no", "not", "null", "nulls", "of",
+    "on", "or", "order", "outer", "over", "partition", "preceding", "proto",
+    "qualify", "range", "recursive", "respect", "right", "rollup", "rows",
+    "select", "set", "some", "struct", "tablesample", "then", "to", "treat",
+    "true", "unbounded", "union", "unnest", "using", "when", "where",
+    "window", "with", "within",
+}
+
+###############################################################################
+# KEYS
+###############################################################################
+
+def _fold_keywords(text: str) -> str:
+    """Lowercase keywords and built-in function names outside quotes"""
+    def fold(match):
+        word = match.group(0)
+        if match.start() > 0 and text[match.start() - 1] == ".":
+            return word  # part of a qualified name, e.g. dataset.Table or dataset.MyUdf(
+        is_call = re.match(r"\s*\(", text[match.end():]) is not None
+        if word.lower() in SQL_KEYWORDS or is_call:
+            return word.lower()
+        return word
+
+    return re.sub(r"\b[A-Za-z_]\w*\b", fold, text)
+
+def normalize_sql(sql: str) -> str:
+    """
+    Canonical form of a SQL statement for coalescing: comments removed,
+    whitespace collapsed, keywords and function names case-folded and
+    trailing semicolons dropped. String literals, `quoted` identifiers,
+    table names and aliases are kept verbatim.
+    """
+    # Comments run to the end of their line, so they must go before newlines
+    # are collapsed or `-- note\nWHERE x` would read as `-- note WHERE x`
+    parts = re.split(
+        r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|--[^\n]*|#[^\n]*|/\*[\s\S]*?\*/)",
+        sql
+    )
+    normalized = []
+    code = ""
+    for i, part in enumerate(parts):
+        if not i % 2:
+            code += part
+        elif part[0] in "-#/":
+            code += " "  # comment
+        else:
+            normalized.append(_fold_keywords(re.sub(r"\s+", " ", code)))
+            normalized.append(part)  # literal or quoted identifier, kept verbatim
+            code = ""
+    normalized.append(_fold_keywords(re.sub(r"\s+", " ", code)).rstrip().rstrip(";"))
+    return "".join(normalized).strip()
+
+def _scope_part(part: Any) -> str:
+    """Stable text for a key scope part; job configs are keyed by their settings"""
+    if hasattr(part, "to_api_repr"):
+        return json.dumps(part.to_api_repr(), sort_keys=True, default=str)
+    return str(part)
+
+def sql_key(sql: str, *scope: Any) -> str:
+    """
+    Key for a query. scope holds whatever else changes the result or its
+    shape: the caller (which decides the return type), the project and
+    dataset, and the job config (e.g. maximum_bytes_billed).
+    """
+    prefix = "|".join(_scope_part(part) for part in scope)
+    return f"sql:{prefix}:{normalize_sql(sql)}"
+
+def prompt_key(*parts: Any) -> str:
+    """Hash of everything that determines a model response"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return "prompt:" + digest.hexdigest()
+
+###############################################################################
+# SINGLE FLIGHT
+###############################################################################
+
+class _Call:
+    """One in-flight execution that duplicates can attach to"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome"""
+
+    def __init__(self, name: str = "default"):
+        self.name = name
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self.metrics = {"calls": 0, "executed": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable, *args, **kwargs):
+        """
+        Return fn(*args, **kwargs), or the result of an identical call
+        already in flight. Shared results must be treated as read-only.
+        """
+        with self._lock:
+            self.metrics["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.metrics["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.metrics["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+def get_single_flight(name: str) -> SingleFlight:
+    """Return the process-wide coalescing group for name (e.g. "bigquery", "gemini")"""
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+def coalescing_metrics() -> Dict[str, Dict[str, int]]:
+    """Metrics of every coalescing group; "coalesced" counts calls saved"""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: dict(group.metrics, in_flight=group.in_flight()) for group in groups}
@@ -0,0 +1,340 @@
+"""
+Streaming export of query results
+Writes result pages incrementally so that large answers never have to be
+held in memory at once:
+1. CSV (optionally gzip/bz2/xz compressed)
+2. Parquet with configurable compression and row-group size
+3. Arrow IPC files with optional lz4/zstd buffer compression
+4. A pretty-printer that sizes columns from a sample instead of every row
+"""
+
+import bz2
+import csv
+import gzip
+import json
+import lzma
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+###############################################################################
+# CONFIGURATIONS
+###############################################################################
+
+EXPORT_PAGE_SIZE = 10000          # rows fetched per page from the warehouse
+PARQUET_ROW_GROUP_SIZE = 100000   # rows buffered per Parquet row group
+PRETTY_SAMPLE_SIZE = 100          # rows used to size pretty-printed columns
+PRETTY_MAX_WIDTH = 60             # longer values are truncated with "..."
+
+CSV_OPENERS = {
+    None: open,
+    "gzip": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+###############################################################################
+# PAGE HELPERS
+###############################################################################
+
+def chunk_rows(rows: Iterable[Dict], page_size: int = EXPORT_PAGE_SIZE) -> Iterator[List[Dict]]:
+    """Group a row iterator into pages of at most page_size rows"""
+    rows = iter(rows)
+    while True:
+        page = list(islice(rows, page_size))
+        if not page:
+            return
+        yield page
+
+# The client parses these into Python objects (JSON into dicts and lists,
+# INTERVAL into relativedelta); exports carry them as text
+TEXT_ENCODERS = {
+    "JSON": lambda value: json.dumps(value, default=str),
+    "INTERVAL": str,
+}
+
+def _needs_encoding(field) -> bool:
+    if field.field_type.upper() in ("RECORD", "STRUCT"):
+        return any(_needs_encoding(sub) for sub in field.fields)
+    return field.field_type.upper() in TEXT_ENCODERS
+
+def _encode_value(field, value, repeated: bool = True):
+    """Encode one value of field as its export schema expects"""
+    if value is None:
+        return None
+    if repeated and field.mode == "REPEATED":
+        return [_encode_value(field, item, repeated=False) for item in value]
+    field_type = field.field_type.upper()
+    if field_type in ("RECORD", "STRUCT"):
+        value = dict(value)
+        for sub in field.fields:
+            if sub.name in value and _needs_encoding(sub):
+                value[sub.name] = _encode_value(sub, value[sub.name])
+        return value
+    return TEXT_ENCODERS[field_type](value)
+
+def iter_bigquery_pages(row_iterator) -> Iterator[List[Dict]]:
+    """
+    Yield pages of dict rows from a BigQuery RowIterator as they are
+    fetched, with JSON and INTERVAL values encoded as text
+    """
+    encoded = [field for field in (row_iterator.schema or []) if _needs_encoding(field)]
+    for page in row_iterator.pages:
+        rows = [dict(row) for row in page]
+        for row in rows:
+            for field in encoded:
+                row[field.name] = _encode_value(field, row.get(field.name))
+        yield rows
+
+def _record_batch(pa, page, schema=None):
+    """Convert a page of dict rows, or a ResultSet page, to a RecordBatch"""
+    if hasattr(page, "to_arrow"):
+        table = page.to_arrow()
+        if schema is not None:
+            table = table.cast(schema)
+        return table.combine_chunks().to_batches()[0]
+    return pa.RecordBatch.from_pylist(page, schema=schema)
+
+def _require_pyarrow():
+    """Import pyarrow lazily so CSV export works without it"""
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("pyarrow is required for Parquet and Arrow export") from e
+    return pyarrow
+
+def _bigquery_arrow_type(pa, field):
+    """Arrow type for one BigQuery SchemaField, including RECORD and REPEATED"""
+    field_type = field.field_type.upper()
+    if field_type in ("RECORD", "STRUCT"):
+        arrow_type = pa.struct([
+            pa.field(sub.name, _bigquery_arrow_type(pa, sub), nullable=sub.mode != "REQUIRED")
+            for sub in field.fields
+        ])
+    else:
+        arrow_type = {
+            "STRING": pa.string(),
+            "BYTES": pa.binary(),
+            "INTEGER": pa.int64(),
+            "INT64": pa.int64(),
+            "FLOAT": pa.float64(),
+            "FLOAT64": pa.float64(),
+            "NUMERIC": pa.decimal128(38, 9),
+            "BIGNUMERIC": pa.decimal256(76, 38),
+            "BOOLEAN": pa.bool_(),
+            "BOOL": pa.bool_(),
+            "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+            "DATETIME": pa.timestamp("us"),
+            "DATE": pa.date32(),
+            "TIME": pa.time64("us"),
+        }.get(field_type, pa.string())  # GEOGRAPHY, JSON, INTERVAL as text (see TEXT_ENCODERS)
+    if field.mode == "REPEATED":
+        arrow_type = pa.list_(arrow_type)
+    return arrow_type
+
+def bigquery_arrow_schema(bigquery_schema):
+    """
+    Arrow schema from a RowIterator's schema, for export_parquet and
+    export_arrow. Declaring it up front avoids guessing types from the first
+    page, where an all-NULL column or an integral FLOAT column would be
+    inferred wrongly.
+    """
+    pa = _require_pyarrow()
+    return pa.schema([
+        pa.field(field.name, _bigquery_arrow_type(pa, field), nullable=field.mode != "REQUIRED")
+        for field in bigquery_schema
+    ])
+
+###############################################################################
+# WRITERS
+###############################################################################
+
+def export_csv(
+    pages: Iterable[Sequence[Dict]],
+    path: str,
+    compression: Optional[str] = None,
+    fieldnames: Optional[Sequence[str]] = None
+) -> int:
+    """
+    Write result pages to a CSV file and return the number of rows written.
+    Columns come from fieldnames when passed, so an empty result still gets
+    a header, and otherwise from the first row.
+    """
+    if compression not in CSV_OPENERS:
+        raise ValueError(f"Unsupported CSV compression: {compression}")
+
+    rows_written = 0
+    with CSV_OPENERS[compression](path, "wt", newline="") as f:
+        writer = None
+        if fieldnames is not None:
+            writer = csv.DictWriter(f, fieldnames=list(fieldnames))
+            writer.writeheader()
+        for page in pages:
+            if not page:
+                continue
+            if writer is None:
+                writer = csv.DictWriter(f, fieldnames=list(page[0].keys()))
+                writer.writeheader()
+            writer.writerows(page)
+            rows_written += len(page)
+    return rows_written
+
+def export_parquet(
+    pages: Iterable[Sequence[Dict]],
+    path: str,
+    compression: str = "snappy",
+    row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+    schema=None
+) -> int:
+    """
+    Write result pages to a Parquet file and return the number of rows written.
+
+    Pass the Arrow schema when it is known (see bigquery_arrow_schema);
+    otherwise it is inferred from the first page, and an empty result
+    writes no file. Pages are buffered only
+    until a full row group is available, so memory is bounded by
+    row_group_size.
+    """
+    pa = _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    rows_written = 0
+    writer = None
+    buffered: List[Any] = []
+    buffered_rows = 0
+
+    def flush(final: bool = False) -> int:
+        """Write full row groups (and the remainder if final); return rows kept"""
+        table = pa.Table.from_batches(buffered, schema=schema)
+        buffered.clear()
+        full = table.num_rows if final else table.num_rows - table.num_rows % row_group_size
+        if full:
+            writer.write_table(table.slice(0, full), row_group_size=row_group_size)
+        remainder = table.slice(full)
+        buffered.extend(remainder.to_batches())
+        return remainder.num_rows
+
+    try:
+        for page in pages:
+            if not page:
+                continue
+            if writer is None:
+                batch = _record_batch(pa, page, schema)
+                schema = batch.schema
+                writer = pq.ParquetWriter(path, schema, compression=compression)
+            else:
+                batch = _record_batch(pa, page, schema)
+            buffered.append(batch)
+            buffered_rows += batch.num_rows
+            rows_written += batch.num_rows
+            if buffered_rows >= row_group_size:
+                buffered_rows = flush()
+        if buffered:
+            flush(final=True)
+        if writer is None and schema is not None:
+            # Empty result: still write a file with the columns
+            writer = pq.ParquetWriter(path, schema, compression=compression)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows_written
+
+def export_arrow(
+    pages: Iterable[Sequence[Dict]],
+    path: str,
+    compression: Optional[str] = None,
+    schema=None
+) -> int:
+    """
+    Write result pages to an Arrow IPC file and return the number of rows
+    written. The schema is inferred from the first page unless passed in;
+    without one, an empty result writes no file.
+    """
+    pa = _require_pyarrow()
+
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    rows_written = 0
+    sink = None
+    writer = None
+    try:
+        for page in pages:
+            if not page:
+                continue
+            if writer is None:
+                batch = _record_batch(pa, page, schema)
+                schema = batch.schema
+                sink = pa.OSFile(path, "wb")
+                writer = pa.ipc.new_file(sink, schema, options=options)
+            else:
+                batch = _record_batch(pa, page, schema)
+            writer.write_batch(batch)
+            rows_written += batch.num_rows
+        if writer is None and schema is not None:
+            # Empty result: still write a file with the columns
+            sink = pa.OSFile(path, "wb")
+            writer = pa.ipc.new_file(sink, schema, options=options)
+    finally:
+        if writer is not None:
+            writer.close()
+        if sink is not None:
+            sink.close()
+    return rows_written
+
+EXPORTERS = {
+    "csv": export_csv,
+    "parquet": export_parquet,
+    "arrow": export_arrow,
+}
+
+def export_results(
+    pages: Iterable[Sequence[Dict]],
+    path: str,
+    fmt: str = "csv",
+    **options
+) -> int:
+    """Dispatch to the writer for fmt ("csv", "parquet" or "arrow")"""
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return EXPORTERS[fmt](pages, path, **options)
+
+###############################################################################
+# PRETTY PRINTING
+###############################################################################
+
+def _cell(value: Any, width: int) -> str:
+    """Render a value into a fixed-width cell, truncating if needed"""
+    text = str(value)
+    if len(text) > width:
+        text = text[:max(width - 3, 0)] + "..."
+    return f"{text:{width}}"
+
+def stream_format_results(
+    rows: Iterable[Dict],
+    sample_size: int = PRETTY_SAMPLE_SIZE,
+    max_width: int = PRETTY_MAX_WIDTH
+) -> Iterator[str]:
+    """
+    Yield a pretty-printed table line by line.
+
+    Column widths are computed from the first sample_size rows only, capped
+    at max_width; later values that do not fit are truncated.
+    """
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    if not sample:
+        yield "No results found."
+        return
+
+    columns: Sequence[str] = list(sample[0].keys())
+    widths = {}
+    for col in columns:
+        widest = max(len(str(row.get(col))) for row in sample)
+        widths[col] = min(max(len(col), widest), max_width)
+
+    header = " | ".join(_cell(col, widths[col]) for col in columns)
+    yield header
+    yield "-" * len(header)
+
+    for row in sample:
+        yield " | ".join(_cell(row.get(col), widths[col]) for col in columns)
+    for row in rows:
+        yield " | ".join(_cell(row.get(col), widths[col]) for col in columns)
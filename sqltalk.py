@@ -2,18 +2,29 @@ import subprocess
 import json
 import requests
 import time
+import random
 from typing import Optional, Union, List, Dict
 import logging
 
+from admission import AdmissionRejected, BackendError, get_admission_controller
+from resultset import ResultSet
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# bq CLI errors that mean BigQuery itself is failing, as opposed to a bad query
+BQ_TRANSIENT_ERRORS = (
+    "backendError", "internalError", "rateLimitExceeded", "quotaExceeded",
+    "Service Unavailable", "Connection", "timed out"
+)
+
 class DatabaseAnalyzer:
     def __init__(self):
         self.project_id = "vz-it-np-ienv-test-vegsdo-0"
         self.dataset_id = "vegas_monitoring"
         self.table_id = "api_status_monitoring"
         self.llm_endpoint = "https://vegas-llm-test.ebiz.verizon.com/vegas/apps/prompt/LLMInsight"
+        self.admission = get_admission_controller()
 
     def test_bq_connection(self) -> bool:
         """Test BigQuery connection by running a simple query"""
@@ -56,32 +67,33 @@ class DatabaseAnalyzer:
             
             logger.info(f"Executing query: {query}")
             
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = process.communicate(timeout=60)
-            
-            if process.returncode != 0:
-                logger.error(f"BQ Query failed: {stderr}")
-                return {"error": stderr}
+            with self.admission.admit("bigquery"):
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True
+                )
+                
+                stdout, stderr = process.communicate(timeout=60)
+                
+                if process.returncode != 0:
+                    logger.error(f"BQ Query failed: {stderr}")
+                    if any(marker in stderr for marker in BQ_TRANSIENT_ERRORS):
+                        # Count it against the bigquery circuit breaker
+                        raise BackendError(stderr)
+                    return {"error": stderr}
             
             # Parse the output into a structured format
             rows = stdout.strip().split('\n')
             if len(rows) < 2:
-                return {"data": []}
+                return {"data": ResultSet([], {})}
             
             headers = rows[0].split()  # Split on whitespace instead of comma
-            data = []
-            for row in rows[1:]:
-                values = row.split()
-                if len(values) == len(headers):
-                    data.append(dict(zip(headers, values)))
+            records = (values for values in (row.split() for row in rows[1:])
+                       if len(values) == len(headers))
             
-            return {"data": data}
+            return {"data": ResultSet.from_records(headers, records)}
             
         except subprocess.TimeoutExpired:
             logger.error("Query execution timed out")
@@ -112,21 +124,28 @@ class DatabaseAnalyzer:
         
         for attempt in range(max_retries):
             try:
-                response = requests.post(
-                    self.llm_endpoint,
-                    json=payload,
-                    headers=headers,
-                    timeout=60
-                )
-                response.raise_for_status()
+                # Every attempt is admitted through the shared llm_api gate so
+                # retries count against the same rate limit and circuit breaker
+                with self.admission.admit("llm_api"):
+                    response = requests.post(
+                        self.llm_endpoint,
+                        json=payload,
+                        headers=headers,
+                        timeout=60
+                    )
+                    response.raise_for_status()
                 return response.json()
                 
+            except AdmissionRejected as e:
+                logger.error(f"LLM API call rejected: {str(e)}")
+                return {"error": str(e)}
             except requests.exceptions.RequestException as e:
                 logger.warning(f"Attempt {attempt + 1} failed: {str(e)}")
                 if attempt == max_retries - 1:
                     logger.error(f"All attempts failed: {str(e)}")
                     return {"error": str(e)}
-                time.sleep(2 ** attempt)
+                # Jitter keeps concurrent callers from retrying in lockstep
+                time.sleep(2 ** attempt * random.uniform(0.5, 1.5))
 
 def main():
     analyzer = DatabaseAnalyzer()
@@ -144,7 +163,7 @@ def main():
     test_query = f"SELECT * FROM `{analyzer.project_id}.{analyzer.dataset_id}.{analyzer.table_id}` LIMIT 5"
     result = analyzer.execute_bq_command(test_query)
     print("\nDirect query result:")
-    print(json.dumps(result, indent=2))
+    print(json.dumps(result, indent=2, default=ResultSet.to_dicts))
     
     # Only proceed with LLM if BigQuery is working
     print("\nWelcome to Database Analyzer!")
@@ -172,43 +191,7 @@ def main():
             f"SELECT * FROM `{analyzer.project_id}.{analyzer.dataset_id}.{analyzer.table_id}` LIMIT 5"
         )
         print("\nDirect query result:")
-        print(json.dumps(direct_result, indent=2))
+        print(json.dumps(direct_result, indent=2, default=ResultSet.to_dicts))
 
 if __name__ == "__main__":
     main()
-
-
-You are an intelligent assistant specialized in converting natural language queries into SQL queries. Your task is to help users retrieve information from their databases by understanding their questions and generating the appropriate SQL queries. 
-
-Guidelines:
-1. Always use the provided database schema to construct your queries.
-2. Ensure the SQL queries are syntactically correct and optimized for performance.
-3. If the user query is ambiguous, ask clarifying questions.
-4. Provide a brief explanation of the generated SQL query.
-5. Do not make up information; only use the information available in the database schema.
-
-Example:
-User Query: "Show me the top 10 customers by purchase amount."
-Generated SQL: "SELECT customer_id, SUM(purchase_amount) as total_purchase FROM purchases GROUP BY customer_id ORDER BY total_purchase DESC LIMIT 10;"
-Explanation: This query retrieves the top 10 customers based on the total purchase amount from the purchases table.
-
-If you encounter any errors or issues, provide a clear error message and log the error for further analysis
-
-{Query}
-"""
-
-
-Executing query directly first...
-INFO:__main__:Executing query: SELECT * FROM `vz-it-np-ienv-test-vegsdo-0.vegas_monitoring.api_status_monitoring` LIMIT 5
-
-Direct query result:
-{
-  "data": [
-    {
-      "+------------+----------------------------+------------+---------+---------------+": "+------------+----------------------------+------------+---------+---------------+"
-    },
-    {
-      "+------------+----------------------------+------------+---------+---------------+": "+------------+----------------------------+------------+---------+---------------+"
-    }
-  ]
-}
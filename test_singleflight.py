@@ -0,0 +1,16 @@
+from singleflight import normalize_sql, sql_key
+
+
+def test_line_comment_does_not_swallow_next_line():
+    commented = "SELECT x FROM t -- note\nWHERE x = 1"
+    inline = "SELECT x FROM t -- note WHERE x = 1"
+    assert normalize_sql(commented) == "select x from t where x = 1"
+    assert normalize_sql(inline) == "select x from t"
+    assert sql_key(commented, "caller") != sql_key(inline, "caller")
+
+
+def test_comments_removed_outside_literals_only():
+    assert normalize_sql("SELECT 'a  b' -- comment\n FROM t") == "select 'a  b' from t"
+    assert normalize_sql("SELECT x # note\nFROM t /* block */ WHERE y = '-- kept';") == (
+        "select x from t where y = '-- kept'"
+    )
@@ -5,6 +5,13 @@ from google.cloud import bigquery
 from google.api_core import exceptions
 from vertexai.generative_models import FunctionDeclaration, GenerativeModel, Part, Tool
 
+from admission import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_admission_controller
+from caches import RESULT_CACHE_SIZE, RESULT_CACHE_TTL, SCHEMA_CACHE_TTL, TTLCache
+from journal import WARMUP_LIMIT, get_query_journal
+from resultset import ResultSet
+from rollups import RollupManager
+from singleflight import get_single_flight, sql_key
+
 
 # "source_project_id":"vz-it-np-ienv-test-vegsdo-0",
 # "source_dataset_id":"vegas_monitoring",
@@ -14,6 +21,9 @@ BIGQUERY_PROJECT_ID = "vz-it-np-ienv-test-vegsdo-0"  # Replace with your project
 BIGQUERY_DATASET_ID = "vegas_monitoring"
 SQLITE_DB_PATH = "your_database.db"  # Replace with your SQLite database path
 USE_BIGQUERY = True  # Set to False to use SQLite instead
+USE_ROLLUPS = False  # Route count-style queries to pre-aggregated rollup tables
+JOURNAL_ENABLED = True  # Journal each question; frequent ones warm the caches at startup
+SQL_QUERY_MAX_BYTES_BILLED = 100000000
 
 # Function declarations
 list_datasets_func = FunctionDeclaration(
@@ -71,8 +81,25 @@ sql_query_func = FunctionDeclaration(
 )
 
 class DatabaseAnalyzer:
-    def __init__(self, use_bigquery=USE_BIGQUERY):
+    def __init__(
+        self,
+        use_bigquery=USE_BIGQUERY,
+        project_id=BIGQUERY_PROJECT_ID,
+        dataset_id=BIGQUERY_DATASET_ID,
+        model=None,
+        client=None,
+        journal_enabled=JOURNAL_ENABLED
+    ):
         self.use_bigquery = use_bigquery
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.admission = get_admission_controller()
+        self.query_flight = get_single_flight("bigquery")
+        # Table listings and schemas change rarely; answers to repeated
+        # questions are served from the result cache for a few minutes
+        self.schema_cache = TTLCache(256, SCHEMA_CACHE_TTL)
+        self.result_cache = TTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.journal = get_query_journal() if journal_enabled else None
         self.sql_query_tool = Tool(
             function_declarations=[
                 list_datasets_func,
@@ -82,33 +109,55 @@ class DatabaseAnalyzer:
             ],
         )
         
-        self.model = GenerativeModel(
+        self.model = model or GenerativeModel(
             "gemini-1.5-pro",
             generation_config={"temperature": 0},
             tools=[self.sql_query_tool],
         )
         
-        # Initialize database connection
-        if self.use_bigquery:
+        # Initialize database connection (an injected client skips the checks)
+        if client is not None:
+            self.client = client
+        elif self.use_bigquery:
             self.init_bigquery()
         else:
             self.init_sqlite()
+        
+        self.rollups = None
+        if USE_ROLLUPS:
+            self.rollups = RollupManager(
+                use_bigquery=self.use_bigquery,
+                client=getattr(self, "client", None),
+                conn=getattr(self, "conn", None),
+                project_id=self.project_id,
+                dataset_id=self.dataset_id
+            )
+            if self.use_bigquery:
+                try:
+                    self.rollups.load_watermarks()
+                except Exception as e:
+                    print(f"Rollup routing disabled, could not read watermarks: {str(e)}")
+        
+        if self.use_bigquery:
+            self.journal_scope = f"testsql|{self.client.project}|{self.dataset_id}"
+        else:
+            self.journal_scope = f"testsql|sqlite|{SQLITE_DB_PATH}"
     
     def init_bigquery(self):
         """Initialize BigQuery client and check connection"""
         try:
             # Explicitly set project
-            self.client = bigquery.Client(project=BIGQUERY_PROJECT_ID)
+            self.client = bigquery.Client(project=self.project_id)
             
             # Test the connection by trying to access the dataset
-            dataset_ref = f"{BIGQUERY_PROJECT_ID}.{BIGQUERY_DATASET_ID}"
+            dataset_ref = f"{self.project_id}.{self.dataset_id}"
             self.client.get_dataset(dataset_ref)
             print("✅ Successfully connected to BigQuery")
-            print(f"   Project: {BIGQUERY_PROJECT_ID}")
-            print(f"   Dataset: {BIGQUERY_DATASET_ID}")
+            print(f"   Project: {self.project_id}")
+            print(f"   Dataset: {self.dataset_id}")
             
             # List available tables
-            dataset = self.client.dataset(BIGQUERY_DATASET_ID)
+            dataset = self.client.dataset(self.dataset_id)
             tables = list(self.client.list_tables(dataset))
             print(f"\nAvailable tables ({len(tables)}):")
             for table in tables:
@@ -148,6 +197,26 @@ class DatabaseAnalyzer:
         
     def process_query(self, prompt):
         """Process a natural language query and return the response"""
+        answer = None
+        for step in self.process_query_steps(prompt):
+            if "answer" in step:
+                answer = step["answer"]
+            else:
+                print(f"Function called: {step['function']}")
+                print(f"Parameters: {step['params']}")
+                print(f"Response: {step['response']}\n")
+        return answer
+
+    def process_query_steps(self, prompt):
+        """
+        Process a natural language query, yielding each function call as a
+        {"function", "params", "response"} dict and finally {"answer": text}.
+        The question, last SQL, stage timings and bytes scanned are journaled
+        once the generator finishes or is closed.
+        """
+        timings = {}
+        trace = {"sql": "", "bytes_processed": None, "cached": False}
+        error = None
         chat = self.model.start_chat()
         
         enhanced_prompt = prompt + """
@@ -158,8 +227,11 @@ class DatabaseAnalyzer:
             """
         
         try:
-            response = chat.send_message(enhanced_prompt)
+            start = time.perf_counter()
+            with self.admission.admit("gemini"):
+                response = chat.send_message(enhanced_prompt)
             response = response.candidates[0].content.parts[0]
+            timings["model"] = time.perf_counter() - start
             
             function_calling_in_process = True
             while function_calling_in_process:
@@ -169,56 +241,134 @@ class DatabaseAnalyzer:
                         params[key] = value
                         
                     # Handle different function calls based on database type
+                    function_name = response.function_call.name
+                    start = time.perf_counter()
                     if self.use_bigquery:
-                        api_response = self._handle_bigquery_function(response.function_call.name, params)
+                        api_response = self._handle_bigquery_function(function_name, params, trace)
                     else:
-                        api_response = self._handle_sqlite_function(response.function_call.name, params)
+                        api_response = self._handle_sqlite_function(function_name, params, trace)
+                    timings[function_name] = timings.get(function_name, 0.0) + time.perf_counter() - start
                     
-                    print(f"Function called: {response.function_call.name}")
-                    print(f"Parameters: {params}")
-                    print(f"Response: {api_response}\n")
+                    yield {
+                        "function": response.function_call.name,
+                        "params": params,
+                        "response": api_response,
+                    }
                     
-                    response = chat.send_message(
-                        Part.from_function_response(
-                            name=response.function_call.name,
-                            response={"content": api_response},
-                        ),
-                    )
+                    start = time.perf_counter()
+                    with self.admission.admit("gemini"):
+                        response = chat.send_message(
+                            Part.from_function_response(
+                                name=function_name,
+                                response={"content": api_response},
+                            ),
+                        )
                     response = response.candidates[0].content.parts[0]
+                    timings["model"] += time.perf_counter() - start
                     
                 except AttributeError:
                     function_calling_in_process = False
                     
-            return response.text
+            yield {"answer": response.text}
             
         except Exception as e:
-            return f"Error processing query: {str(e)}"
+            error = str(e)
+            yield {"answer": f"Error processing query: {str(e)}"}
+        finally:
+            # The journal writes on its own thread, so this does not add latency
+            if self.journal:
+                self.journal.record(
+                    prompt,
+                    trace["sql"],
+                    timings,
+                    trace["bytes_processed"],
+                    error,
+                    cached=trace["cached"],
+                    scope=self.journal_scope
+                )
     
-    def _handle_bigquery_function(self, function_name, params):
-        """Handle BigQuery-specific function calls"""
+    def _handle_bigquery_function(self, function_name, params, trace=None):
+        """
+        Handle BigQuery-specific function calls. For sql_query, trace (if
+        given) receives the SQL run, the bytes this call scanned and whether
+        the result came from the cache or another user's job.
+        """
         if function_name == "list_datasets":
-            return BIGQUERY_DATASET_ID
+            return self.dataset_id
             
         elif function_name == "list_tables":
-            tables = self.client.list_tables(params["dataset_id"])
-            return str([table.table_id for table in tables])
+            return self.schema_cache.get_or_compute(
+                ("list_tables", params["dataset_id"]),
+                lambda: str([table.table_id for table in self.client.list_tables(params["dataset_id"])])
+            )
             
         elif function_name == "get_table":
-            table = self.client.get_table(params["table_id"])
-            table_info = table.to_api_repr()
-            return str({
-                'description': table_info.get('description', ''),
-                'schema': [column['name'] for column in table_info['schema']['fields']]
-            })
+            return self.schema_cache.get_or_compute(
+                ("get_table", params["table_id"]),
+                lambda: self._describe_table(params["table_id"])
+            )
             
         elif function_name == "sql_query":
-            job_config = bigquery.QueryJobConfig(maximum_bytes_billed=100000000)
             cleaned_query = params["query"].replace("\\n", " ").replace("\n", "").replace("\\", "")
-            query_job = self.client.query(cleaned_query, job_config=job_config)
-            results = query_job.result()
-            return str([dict(row) for row in results])
+            if self.rollups:
+                cleaned_query = self.rollups.route(cleaned_query)
+            return self._run_sql(cleaned_query, trace=trace)
+    
+    def _describe_table(self, table_id):
+        table = self.client.get_table(table_id)
+        table_info = table.to_api_repr()
+        return str({
+            'description': table_info.get('description', ''),
+            'schema': [column['name'] for column in table_info['schema']['fields']]
+        })
+    
+    def _run_sql(self, cleaned_query, priority=PRIORITY_INTERACTIVE, trace=None):
+        """Run a query on BigQuery through the result cache and return the rows as text"""
+        job_config = bigquery.QueryJobConfig(maximum_bytes_billed=SQL_QUERY_MAX_BYTES_BILLED)
+        executed = []
+        
+        def run_query():
+            with self.admission.admit("bigquery", priority=priority):
+                query_job = self.client.query(cleaned_query, job_config=job_config)
+                results = query_job.result()
+            executed.append(query_job.total_bytes_processed or 0)
+            return str(ResultSet.from_bigquery(results))
+        
+        # Concurrent users asking for the same SQL share one BigQuery job.
+        # The key is scoped to this caller (which returns str), the project
+        # and dataset unqualified names resolve against, and the job config
+        key = sql_key(cleaned_query, "testsql", self.client.project, self.dataset_id, job_config)
+        response = self.result_cache.get_or_compute(key, lambda: self.query_flight.do(key, run_query))
+        if trace is not None:
+            trace["sql"] = cleaned_query
+            trace["cached"] = not executed
+            trace["bytes_processed"] = (trace["bytes_processed"] or 0) + sum(executed)
+        return response
     
-    def _handle_sqlite_function(self, function_name, params):
+    def warm_caches(self, limit=WARMUP_LIMIT):
+        """
+        Replay this analyzer's most frequent recent journal entries at batch
+        priority, fetching the schemas of the tables they read and their SQL
+        into the schema and result caches. Returns the number of results warmed.
+        """
+        if not (self.journal and self.use_bigquery):
+            return 0
+        warmed = 0
+        for entry in self.journal.frequent_entries(limit, scope=self.journal_scope):
+            try:
+                for table_id in entry["tables"]:
+                    self.schema_cache.get_or_compute(
+                        ("get_table", table_id),
+                        lambda: self._describe_table(table_id)
+                    )
+                if entry.get("sql"):
+                    self._run_sql(entry["sql"], priority=PRIORITY_BATCH)
+                    warmed += 1
+            except Exception as e:
+                print(f"Skipped warming cache for {entry['question']!r}: {str(e)}")
+        return warmed
+    
+    def _handle_sqlite_function(self, function_name, params, trace=None):
         """Handle SQLite-specific function calls"""
         if function_name == "list_datasets":
             return "sqlite_database"
@@ -238,10 +388,10 @@ class DatabaseAnalyzer:
             
         elif function_name == "sql_query":
             cleaned_query = params["query"].replace("\\n", " ").replace("\n", "").replace("\\", "")
+            if trace is not None:
+                trace["sql"] = cleaned_query
             self.cursor.execute(cleaned_query)
-            columns = [description[0] for description in self.cursor.description]
-            results = self.cursor.fetchall()
-            return str([dict(zip(columns, row)) for row in results])
+            return str(ResultSet.from_cursor(self.cursor))
 
 def main():
     # Create analyzer instance - choose database type here
@@ -273,6 +423,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
-wrap this with gradio as input to select the project , dataset and query and output as result . also add the in btween processing happens during fuction calling by clicking expand option while processing the input nl. name this ap as NL to SQL - Verizon